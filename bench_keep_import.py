@@ -0,0 +1,214 @@
+"""Offline benchmarks for the importer's non-browser hot paths.
+
+Runs against generated data only (no Chrome, no Selenium). Compares each case with the stored
+baseline and exits non-zero when one is slower by more than the threshold.
+
+    python3 bench_keep_import.py                    # run and check against bench_baseline.json
+    python3 bench_keep_import.py --update-baseline  # record this machine's timings as the baseline
+    python3 bench_keep_import.py --memory 200000     # peak RSS of loading state for a corpus that size
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import shutil
+import argparse
+import tempfile
+import resource
+import subprocess
+from typing import Any, Callable, Dict, List
+
+import migrate_keep_notes as mkn
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_THRESHOLD = 0.30  # fail when a case is more than 30% slower than its baseline
+NOISE_FLOOR_SECONDS = 0.005  # ...and slower by at least this much (millisecond cases jitter with disk/cache state)
+REPEATS = 5
+MANIFEST_SIZES = (1_000, 10_000, 100_000)
+CORPUS_SIZE = 2_000
+
+WORDS = ('note', 'keep', 'list', 'milk', 'eggs', 'call', 'Mom', 'idea', 'project', 'draft', 'todo',
+         'meeting', 'Über', 'café', '日本', 'emoji 🎉', "it's", '"quoted"')
+
+def synthetic_note(rng: random.Random, i: int) -> Dict[str, Any]:
+    """A Takeout-shaped note; roughly a third are checklists, with a mix of sizes and attributes."""
+    note: Dict[str, Any] = {
+        'color': rng.choice(list(mkn.COLOR_MAP)),
+        'isTrashed': False,
+        'isPinned': rng.random() < 0.1,
+        'isArchived': rng.random() < 0.2,
+        'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 6))),
+        'userEditedTimestampUsec': 1_600_000_000_000_000 + i * 1_000_003,
+        'labels': [{'name': rng.choice(WORDS)} for _ in range(rng.randint(0, 3))],
+    }
+    if i % 3 == 0:
+        note['listContent'] = [{'text': ' '.join(rng.choice(WORDS) for _ in range(4)), 'isChecked': rng.random() < 0.5}
+                               for _ in range(rng.randint(1, 15))]
+    else:
+        note['textContent'] = ' '.join(rng.choice(WORDS) for _ in range(rng.choice((5, 50, 500))))
+    return note
+
+def synthetic_manifest(n: int) -> Dict[str, Any]:
+    return {
+        hashlib.sha1(str(i).encode('ascii')).hexdigest(): {'file': f"note_{i}.json", 'title': f"Synthetic note {i}", 'ts': 1_700_000_000 + i}
+        for i in range(n)
+    }
+
+def write_journal(path: str, manifest: Dict[str, Any]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for note_id, entry in manifest.items():
+            f.write(json.dumps({'id': note_id, **entry}, ensure_ascii=False) + '\n')
+
+def record_entries(workdir: str, manifest: Dict[str, Any]) -> None:
+    """Append every entry to a fresh journal through Manifest.record (one fsync per note, as in a run)."""
+    path = os.path.join(workdir, 'record_manifest.jsonl')
+    if os.path.exists(path):
+        os.remove(path)
+    journal = mkn.open_manifest(path)
+    for note_id, entry in manifest.items():
+        journal.record(note_id, entry)
+
+def write_corpus(root: str, n: int) -> None:
+    """n note files spread over nested folders, like an unpacked Takeout archive."""
+    rng = random.Random(7)
+    for i in range(n):
+        folder = os.path.join(root, f"part{i % 10}", f"sub{i % 7}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"note_{i}.json"), 'w', encoding='utf-8') as f:
+            json.dump(synthetic_note(rng, i), f, ensure_ascii=False)
+
+def measure(fn: Callable[[], Any], repeats: int = REPEATS) -> float:
+    """Best-of-N wall time in seconds (the minimum is the least noisy estimate)."""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def run_benchmarks(workdir: str) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    rng = random.Random(42)
+
+    notes = [synthetic_note(rng, i) for i in range(10_000)]
+    results['compute_note_id[10k notes]'] = measure(lambda: [mkn.compute_note_id(n) for n in notes])
+
+    mkn.MANIFEST_PATH = os.path.join(workdir, 'import_manifest.json')
+    journal = os.path.join(workdir, 'import_manifest.jsonl')
+    for size in MANIFEST_SIZES:
+        manifest = synthetic_manifest(size)
+        write_journal(journal, manifest)
+        results[f'open_manifest[{size}]'] = measure(lambda: mkn.open_manifest(journal), repeats=3)
+        loaded = mkn.open_manifest(journal)
+        # Half present, half absent
+        probes = [hashlib.sha1(str(i).encode('ascii')).hexdigest() for i in range(0, 2 * size, max(1, size // 5_000))]
+        results[f'manifest_lookup[{size}]'] = measure(lambda: [p in loaded for p in probes])
+        results[f'manifest_record[{size}]'] = measure(lambda: record_entries(workdir, manifest), repeats=1)
+
+    corpus = os.path.join(workdir, 'Keep')
+    write_corpus(corpus, CORPUS_SIZE)
+    results[f'scan_json_files[{CORPUS_SIZE}]'] = measure(lambda: mkn.scan_json_files(corpus))
+    files = mkn.scan_json_files(corpus)
+    results[f'index_notes[{CORPUS_SIZE}]'] = measure(lambda: mkn.index_notes(files), repeats=3)
+    results['parse_note[10k]'] = measure(lambda: [mkn.parse_note(n) for n in notes])
+
+    pathological = [
+        "'" * 5_000,
+        '"' * 5_000,
+        "'\"" * 5_000,
+        ("it's a \"quote\" " * 2_000),
+        "x" * 100_000,
+    ]
+    results['_xpath_literal[pathological]'] = measure(lambda: [mkn._xpath_literal(s) for s in pathological for _ in range(20)])
+    return results
+
+def peak_rss_mb() -> float:
+    # Linux keeps ru_maxrss across exec, so it would report the parent's peak; VmHWM is per process image
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB on Linux
+
+def memory_probe(workdir: str) -> None:
+    """Child process: load the state an import run holds for the whole corpus, then print peak RSS."""
+    before = peak_rss_mb()
+    mkn.MANIFEST_PATH = os.path.join(workdir, 'import_manifest.json')
+    manifest = mkn.open_manifest(os.path.join(workdir, 'import_manifest.jsonl'))
+    entries = mkn.schedule_notes(mkn.index_notes(mkn.scan_json_files(os.path.join(workdir, 'Keep'))),
+                                 mkn.parse_priority(mkn.DEFAULT_PRIORITY))
+    print(f"{len(entries)} notes, {len(manifest)} manifest entries: peak RSS {peak_rss_mb():.0f} MB "
+          f"({before:.0f} MB after imports)")
+
+def run_memory(n: int) -> None:
+    """Peak RSS for an n-note corpus with an n-entry manifest, measured in a fresh process."""
+    workdir = tempfile.mkdtemp(prefix='keep_bench_mem_')
+    try:
+        print(f"Writing {n} synthetic notes...")
+        write_corpus(os.path.join(workdir, 'Keep'), n)
+        write_journal(os.path.join(workdir, 'import_manifest.jsonl'), synthetic_manifest(n))
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--memory-probe', workdir], check=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """Print a results table; return the names of cases that regressed past the threshold."""
+    regressions = []
+    print(f"{'case':40} {'seconds':>10} {'baseline':>10} {'change':>8}")
+    for name, secs in results.items():
+        base = baseline.get(name)
+        if base:
+            change = secs / base - 1
+            flag = '  REGRESSION' if change > threshold and secs - base > NOISE_FLOOR_SECONDS else ''
+            if flag:
+                regressions.append(name)
+            print(f"{name:40} {secs:10.4f} {base:10.4f} {change:+7.0%}{flag}")
+        else:
+            print(f"{name:40} {secs:10.4f} {'-':>10} {'new':>8}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the Keep importer (offline)')
+    parser.add_argument('--update-baseline', action='store_true', help=f'Write these timings to {os.path.basename(BASELINE_PATH)}')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed slowdown vs baseline (0.30 = 30%%)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline file to compare against / update')
+    parser.add_argument('--memory', type=int, metavar='N', default=None, help='Report peak RSS of loading an N-note corpus and N-entry manifest, then exit')
+    parser.add_argument('--memory-probe', metavar='DIR', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_probe:
+        memory_probe(args.memory_probe)
+        return
+    if args.memory:
+        run_memory(args.memory)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='keep_bench_')
+    try:
+        results = run_benchmarks(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline: Dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
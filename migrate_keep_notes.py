@@ -1,29 +1,40 @@
 import os
 import sys
 import re
+import gzip
 import json
 import time
+import queue
 import random
+import bisect
 import hashlib
+import socket
+import sqlite3
 import argparse
+import threading
+from array import array
+from collections import deque
+from itertools import accumulate
 from datetime import datetime
-from typing import Any, Dict, List
-
-# Selenium imports
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
-
-# Browser driver (undetected-chromedriver preferred)
-try:
-    import undetected_chromedriver as uc
-except Exception as _e:
-    uc = None  # We'll fail later when creating the driver if not installed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional
+
+# Selenium and the browser driver are imported by load_selenium() on first use, so offline
+# commands (--plan) start instantly. Until then these names are placeholders.
+By = WebDriverWait = EC = uc = None
+TimeoutException = WebDriverException = Exception
 # --- Configuration ---
 BASE_DIR = os.getcwd()
 DEBUG_DIR = os.path.join(BASE_DIR, '.debug')
+# Imported notes, one JSON line each (append-only). MANIFEST_PATH is the older single-file format,
+# read once to seed the journal when no journal exists yet.
+MANIFEST_JOURNAL_PATH = os.path.join(BASE_DIR, 'import_manifest.jsonl')
 MANIFEST_PATH = os.path.join(BASE_DIR, 'import_manifest.json')
+# Write-ahead record of notes whose creation started but was not yet committed to the manifest
+INFLIGHT_PATH = os.path.join(BASE_DIR, 'import_inflight.json')
+# --reconcile: scraped account contents and the resulting diff against the source notes
+RECONCILE_DB_PATH = os.path.join(BASE_DIR, 'keep_notes.db')
+RECONCILE_REPORT_PATH = os.path.join(BASE_DIR, 'reconcile_report.json')
 CHROME_PROFILE_DIR = os.path.join(BASE_DIR, '.chrome-profile')
 
 # Directory to scan for exported Keep JSON files.
@@ -51,10 +62,25 @@ COLOR_MAP = {
     'GRAY': 'Gray',
 }
 
+# Notes with more text than this are typed in verified chunks instead of through the one-shot fast path
+LARGE_NOTE_CHARS = 5_000
+LARGE_NOTE_CHUNK_CHARS = 2_000
+CHUNK_SETTLE_SECONDS = 3  # how long the editor may lag behind a typed chunk before it counts as dropped
+# Keep refuses to save notes much past 20,000 characters; --split-long cuts bigger ones into parts below this
+KEEP_MAX_NOTE_CHARS = 19_000
+
+# Startup: how long to look for the composer before assuming a login is needed, and how long to wait for that login
+SESSION_CHECK_SECONDS = 15
+LOGIN_TIMEOUT_SECONDS = 300
+KEEP_HOME_URL = 'https://keep.google.com/#home'
+
 # --- Helper functions ---
 
 DEBUG = False
 LIMIT = None
+USE_CDP = False  # --cdp: route hot text entry / DOM queries over the DevTools channel
+USE_AGENT = False  # --agent: create each note with one call into an injected in-page script
+DEBUG_RING_SIZE = 20  # --debug-ring: debug snapshots kept in memory until a failure flushes them
 
 def ensure_dir(path: str):
     try:
@@ -72,35 +98,108 @@ def sanitize_filename(name: str) -> str:
     name = re.sub(r'[\\/:*?"<>|]+', '_', name)
     return name[:80]
 
+class DebugCapture:
+    """Ring buffer of the last N debug snapshots, written to disk on a background thread only on failure.
+
+    Capturing costs one screenshot call and no disk I/O; HTML is gzip-compressed when persisted.
+    """
+
+    def __init__(self, size: int):
+        self._ring: deque = deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, name: str, png: Optional[bytes], html: Optional[str]) -> None:
+        ts = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        with self._lock:
+            self._ring.append((ts, sanitize_filename(name), png, html))
+
+    def flush(self, reason: str) -> None:
+        """Hand the buffered steps leading up to a failure to the writer thread."""
+        with self._lock:
+            batch = list(self._ring)
+            self._ring.clear()
+        if not batch:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer, name='debug-capture', daemon=True)
+            self._thread.start()
+        self._queue.put((reason, batch))
+
+    def close(self, timeout: float = 30) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _writer(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            reason, batch = job
+            out_dir = os.path.join(DEBUG_DIR, f"{batch[-1][0]}_{sanitize_filename(reason)}")
+            ensure_dir(out_dir)
+            for ts, name, png, html in batch:
+                base = os.path.join(out_dir, f"{ts}_{name}")
+                try:
+                    if png:
+                        with open(base + '.png', 'wb') as f:
+                            f.write(png)
+                    if html is not None:
+                        with gzip.open(base + '.html.gz', 'wt', encoding='utf-8') as f:
+                            f.write(html)
+                except Exception as e:
+                    debug_log(f"Failed to write debug artifact {base}: {e}")
+            debug_log(f"Saved {len(batch)} debug snapshot(s) to: {out_dir}")
+
+DEBUG_CAPTURE: Optional[DebugCapture] = None
+
 def snap(driver, name: str, html: bool = False):
-    if not DEBUG:
+    """Buffer a screenshot (and optionally the page source) of the current step in memory."""
+    if not DEBUG or DEBUG_CAPTURE is None or driver is None:
         return
-    ensure_dir(DEBUG_DIR)
-    ts = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    base = f"{ts}_{sanitize_filename(name)}"
-    png_path = os.path.join(DEBUG_DIR, base + '.png')
+    png = None
+    page = None
     try:
-        if driver is None:
-            return
         # Skip if window already closed
         if not getattr(driver, 'window_handles', []):
             return
-        driver.save_screenshot(png_path)
-        debug_log(f"Saved screenshot: {png_path}")
+        png = driver.get_screenshot_as_png()
     except Exception as e:
-        debug_log(f"Failed to save screenshot: {e}")
+        debug_log(f"Failed to capture screenshot: {e}")
     if html:
-        html_path = os.path.join(DEBUG_DIR, base + '.html')
         try:
-            if driver is None or not getattr(driver, 'window_handles', []):
-                return
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write(driver.page_source)
-            debug_log(f"Saved page source: {html_path}")
+            page = driver.page_source
         except Exception as e:
-            debug_log(f"Failed to save page source: {e}")
+            debug_log(f"Failed to capture page source: {e}")
+    DEBUG_CAPTURE.add(name, png, page)
+
+def snap_failure(driver, name: str):
+    """Capture the failing step with its page source and persist the buffered history around it."""
+    if not DEBUG or DEBUG_CAPTURE is None:
+        return
+    snap(driver, name, html=True)
+    DEBUG_CAPTURE.flush(name)
+
+def load_selenium():
+    """Import Selenium and undetected-chromedriver (preferred browser driver) into module globals."""
+    global By, WebDriverWait, EC, TimeoutException, WebDriverException, uc
+    if By is not None:
+        return
+    from selenium.webdriver.common.by import By as _By
+    from selenium.webdriver.support.ui import WebDriverWait as _WebDriverWait
+    from selenium.webdriver.support import expected_conditions as _EC
+    from selenium.common.exceptions import TimeoutException as _TimeoutException, WebDriverException as _WebDriverException
+    try:
+        import undetected_chromedriver as _uc
+    except Exception:
+        _uc = None  # We'll fail below when creating the driver if not installed
+    By, WebDriverWait, EC, uc = _By, _WebDriverWait, _EC, _uc
+    TimeoutException, WebDriverException = _TimeoutException, _WebDriverException
 
 def create_driver():
+    load_selenium()
     os.makedirs(CHROME_PROFILE_DIR, exist_ok=True)
     chrome_options = uc.ChromeOptions()
     chrome_options.add_argument(f"--user-data-dir={CHROME_PROFILE_DIR}")
@@ -115,6 +214,47 @@ def create_driver():
         drv = uc.Chrome(options=chrome_options)
     return drv
 
+def _cdp_cmd(driver, cmd: str, params: Dict[str, Any]):
+    """Run a DevTools command; a transport failure turns the CDP path off for the rest of the run."""
+    global USE_CDP
+    try:
+        return driver.execute_cdp_cmd(cmd, params)
+    except Exception as e:
+        debug_log(f"CDP {cmd} failed; falling back to WebDriver for this run: {e}")
+        USE_CDP = False
+        raise
+
+def cdp_insert_text(driver, text: str) -> bool:
+    """Insert text at the focused element in one call (fires the same input events as IME commit)."""
+    if not USE_CDP or not text:
+        return False
+    try:
+        _cdp_cmd(driver, 'Input.insertText', {'text': text})
+        return True
+    except Exception:
+        return False
+
+def cdp_evaluate(driver, body: str, *args):
+    """Evaluate a script body (execute_script style, using arguments[i]) via Runtime.evaluate.
+
+    Returns (ok, value). Args must be JSON-serializable; ok is False when CDP is off or the script threw.
+    """
+    if not USE_CDP:
+        return False, None
+    expression = f"(function(){{{body}}}).apply(null, {json.dumps(list(args), ensure_ascii=False)})"
+    try:
+        res = _cdp_cmd(driver, 'Runtime.evaluate', {
+            'expression': expression,
+            'returnByValue': True,
+            'awaitPromise': True,
+        })
+    except Exception:
+        return False, None
+    if res.get('exceptionDetails'):
+        debug_log(f"CDP evaluate raised: {res['exceptionDetails'].get('text')}")
+        return False, None
+    return True, (res.get('result') or {}).get('value')
+
 def load_manifest() -> Dict[str, Any]:
     if os.path.exists(MANIFEST_PATH):
         try:
@@ -124,11 +264,211 @@ def load_manifest() -> Dict[str, Any]:
             return {}
     return {}
 
-def save_manifest(manifest: Dict[str, Any]) -> None:
-    tmp_path = MANIFEST_PATH + '.tmp'
+class _DigestView:
+    """Read-only sequence view of a blob of 20-byte digests, so bisect can search it in place."""
+    __slots__ = ('blob',)
+
+    def __init__(self, blob: bytes):
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.blob) // 20
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.blob[i * 20:i * 20 + 20]
+
+class DigestSet:
+    """Set of hex SHA-1 note ids stored as 20-byte digests.
+
+    Loaded ids live in one sorted bytes blob. A table of where each 1- or 2-byte prefix starts (2 bytes
+    once there are enough ids to fill it) narrows a lookup to a handful of digests, which bisect
+    searches. Ids added later go into a small set. That is about 20 bytes per loaded id, plus at most
+    256 KB for the table, against ~150 for a hex string key and its dict slot.
+    """
+    __slots__ = ('_view', '_starts', '_wide', '_added')
+
+    def __init__(self, digests: Iterable[bytes] = ()):
+        ordered = sorted(set(digests))
+        self._wide = len(ordered) > 4096
+        counts = [0] * (65536 if self._wide else 256)
+        for d in ordered:
+            counts[(d[0] << 8) | d[1] if self._wide else d[0]] += 1
+        self._view = _DigestView(b''.join(ordered))
+        self._starts = array('I', accumulate(counts, initial=0))
+        self._added = set()
+
+    def __contains__(self, note_id: str) -> bool:
+        try:
+            digest = bytes.fromhex(note_id)
+        except (TypeError, ValueError):
+            return False
+        if len(digest) != 20:
+            return False
+        if digest in self._added:
+            return True
+        prefix = (digest[0] << 8) | digest[1] if self._wide else digest[0]
+        hi = self._starts[prefix + 1]
+        i = bisect.bisect_left(self._view, digest, self._starts[prefix], hi)
+        return i < hi and self._view[i] == digest
+
+    def __len__(self) -> int:
+        return len(self._view) + len(self._added)
+
+    def add(self, note_id: str) -> None:
+        if note_id not in self:
+            self._added.add(bytes.fromhex(note_id))
+
+class Manifest:
+    """Imported note ids, backed by the append-only journal; the per-note details stay on disk."""
+    __slots__ = ('path', 'ids')
+
+    def __init__(self, path: str, ids: DigestSet):
+        self.path = path
+        self.ids = ids
+
+    def __contains__(self, note_id: str) -> bool:
+        return note_id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def record(self, note_id: str, entry: Dict[str, Any]) -> None:
+        """Append one entry; the note counts as imported once this returns (fsynced, like the in-flight file)."""
+        line = json.dumps({'id': note_id, **entry}, ensure_ascii=False)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.ids.add(note_id)
+
+def open_manifest(path: Optional[str] = None) -> Manifest:
+    """Load the ids of imported notes from the journal, seeding it from import_manifest.json on first use."""
+    path = path or MANIFEST_JOURNAL_PATH
+    if not os.path.exists(path) and os.path.exists(MANIFEST_PATH):
+        legacy = load_manifest()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for note_id, entry in legacy.items():
+                f.write(json.dumps({'id': note_id, **entry}, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+        print(f"Moved {len(legacy)} manifest entries from {os.path.basename(MANIFEST_PATH)} to {os.path.basename(path)}.")
+        del legacy
+    digests: List[bytes] = []
+    torn = False
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                torn = not line.endswith(b'\n')
+                # Fast path for lines written by Manifest.record; anything else goes through the JSON parser
+                if line.startswith(b'{"id": "') and line.endswith(b'}\n'):
+                    try:
+                        digests.append(bytes.fromhex(line[8:48].decode('ascii')))
+                        continue
+                    except ValueError:
+                        pass
+                try:
+                    digests.append(bytes.fromhex(json.loads(line)['id']))
+                except (ValueError, KeyError, TypeError):
+                    continue  # a line cut short by a crash
+        if torn:
+            # Start the next append on a fresh line
+            with open(path, 'ab') as f:
+                f.write(b'\n')
+    return Manifest(path, DigestSet(digests))
+
+def load_inflight() -> Dict[str, Any]:
+    """Notes that were being created when a previous run stopped (crash, kill, closed window)."""
+    if os.path.exists(INFLIGHT_PATH):
+        try:
+            with open(INFLIGHT_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    return {}
+
+def save_inflight(inflight: Dict[str, Any]) -> None:
+    # fsync before the rename: this record must survive a hard crash to be useful
+    tmp_path = INFLIGHT_PATH + '.tmp'
     with open(tmp_path, 'w', encoding='utf-8') as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
-    os.replace(tmp_path, MANIFEST_PATH)
+        json.dump(inflight, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, INFLIGHT_PATH)
+
+def mark_inflight(inflight: Dict[str, Any], note_id: str, filename: str, title: str, is_archived: bool,
+                  search: Optional[str] = None) -> None:
+    """Record that creation of note_id is about to start (call before touching the composer).
+
+    `search` is the full-text search term the next run uses to check a large note (see recovery_search).
+    """
+    inflight[note_id] = {
+        'file': filename,
+        'title': title,
+        'archived': bool(is_archived),
+        'ts': int(time.time()),
+    }
+    if search:
+        inflight[note_id]['search'] = search
+    save_inflight(inflight)
+
+def clear_inflight(inflight: Dict[str, Any], note_id: str) -> None:
+    if inflight.pop(note_id, None) is not None:
+        save_inflight(inflight)
+
+def commit_note(manifest: Manifest, inflight: Dict[str, Any], note_id: str, filename: str, title: str,
+                **extra: Any) -> None:
+    """Record a note as imported; the in-flight record goes only after the manifest is on disk.
+
+    Split notes add `group`/`part` to each part's entry and `parts` to the source note's entry.
+    """
+    manifest.record(note_id, {
+        'file': filename,
+        'title': title,
+        'ts': int(time.time()),
+        **extra,
+    })
+    clear_inflight(inflight, note_id)
+
+def _label_names(raw_labels: List[Any]) -> List[str]:
+    """Takeout labels are dicts ({'name': ...}) or, in older exports, plain strings (interned: they repeat a lot)."""
+    names: List[str] = []
+    for lab in raw_labels:
+        if isinstance(lab, dict):
+            n = lab.get('name') or lab.get('label')
+            if n:
+                names.append(sys.intern(n))
+        elif isinstance(lab, str):
+            names.append(sys.intern(lab))
+    return names
+
+def parse_note(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a Takeout note dict into the fields the importer uses."""
+    labels = _label_names(data.get('labels', []) or [])
+    if IMPORT_LABEL:
+        labels.append(IMPORT_LABEL)
+    return {
+        'title': data.get('title', '') or '',
+        'content': data.get('textContent', '') or '',
+        'items': data.get('listContent', []) or [],
+        'color_key': sys.intern(data.get('color', 'DEFAULT') or 'DEFAULT'),
+        'is_pinned': bool(data.get('isPinned', False)),
+        'is_archived': bool(data.get('isArchived', False)),
+        'labels': labels,
+    }
+
+def scan_json_files(notes_dir: str) -> List[str]:
+    """Find Takeout .json files under notes_dir (recursive), excluding our own state files."""
+    own_files = (os.path.abspath(MANIFEST_PATH), os.path.abspath(INFLIGHT_PATH), os.path.abspath(RECONCILE_REPORT_PATH))
+    json_files: List[str] = []
+    for root, _, files in os.walk(notes_dir):
+        for f in files:
+            if f.endswith('.json'):
+                full_path = os.path.join(root, f)
+                # Skip our manifest/in-flight files if they're inside the scan directory
+                if os.path.abspath(full_path) in own_files:
+                    continue
+                json_files.append(full_path)
+    return json_files
 
 def compute_note_id(data: Dict[str, Any]) -> str:
     """Stable hash of note content to prevent duplicates across runs."""
@@ -138,15 +478,7 @@ def compute_note_id(data: Dict[str, Any]) -> str:
     is_pinned = data.get('isPinned', False)
     is_archived = data.get('isArchived', False)
     color = data.get('color', 'DEFAULT') or 'DEFAULT'
-    labels = data.get('labels', []) or []
-    label_names: List[str] = []
-    for lab in labels:
-        if isinstance(lab, dict):
-            n = lab.get('name') or lab.get('label')
-            if n:
-                label_names.append(n)
-        elif isinstance(lab, str):
-            label_names.append(lab)
+    label_names = _label_names(data.get('labels', []) or [])
     payload = {
         'title': title,
         'text': txt,
@@ -222,9 +554,27 @@ def wait_for_keep_url(driver, timeout=300):
     debug_log('Waiting for keep.google.com URL...')
     return wait.until(lambda d: isinstance(getattr(d, 'current_url', ''), str) and 'keep.google.com' in d.current_url)
 
-def wait_for_keep_ready(driver):
+def keep_session_ready(driver, budget: float = SESSION_CHECK_SECONDS) -> bool:
+    """Fast path for a logged-in profile: True once the composer shows up within budget seconds.
+
+    Returns False early if Keep redirected to the Google sign-in page.
+    """
+    end = time.time() + budget
+    while time.time() < end:
+        try:
+            url = getattr(driver, 'current_url', '') or ''
+            if 'accounts.google.com' in url:
+                return False
+            if 'keep.google.com' in url and driver.find_elements(By.CSS_SELECTOR, '[aria-label^="Take a note"]'):
+                return True
+        except Exception:
+            pass
+        time.sleep(0.2)
+    return False
+
+def wait_for_keep_ready(driver, timeout: int = LOGIN_TIMEOUT_SECONDS):
     # Robust readiness: presence of any editor/composer nodes
-    wait = WebDriverWait(driver, 300)
+    wait = WebDriverWait(driver, timeout)
     debug_log(f"Current URL before readiness: {getattr(driver, 'current_url', '')}")
     try:
         wait.until(lambda d: isinstance(getattr(d, 'current_url', ''), str) and 'keep.google.com' in d.current_url)
@@ -239,6 +589,9 @@ def wait_for_keep_ready(driver):
         'div[aria-label="Title"]',
     ]
     def any_present(d):
+        ok, found = cdp_evaluate(d, "return !!document.querySelector(arguments[0]);", ', '.join(selectors))
+        if ok:
+            return bool(found)
         try:
             for sel in selectors:
                 if d.find_elements(By.CSS_SELECTOR, sel):
@@ -481,8 +834,8 @@ def get_content_editor(driver):
             debug_log('Content editor found (contenteditable=true).')
             return el
 
-def _send_text_to_element(driver, el, text: str):
-    """Robustly send text to an input or contenteditable element and trigger input events."""
+def _focus_and_clear(driver, el):
+    """Click into an input or contenteditable element and delete whatever it holds."""
     from selenium.webdriver.common.keys import Keys
     try:
         el.click()
@@ -504,6 +857,16 @@ def _send_text_to_element(driver, el, text: str):
     except Exception:
         pass
 
+def _send_text_to_element(driver, el, text: str):
+    """Robustly send text to an input or contenteditable element and trigger input events."""
+    from selenium.webdriver.common.keys import Keys
+    _focus_and_clear(driver, el)
+
+    # Fast path: one DevTools call instead of a send_keys round trip per chunk
+    if cdp_insert_text(driver, text):
+        short_sleep(0.05, 0.15)
+        return
+
     # Type text in chunks to avoid flakiness on long strings
     try:
         if text:
@@ -525,6 +888,62 @@ def _send_text_to_element(driver, el, text: str):
             pass
     short_sleep(0.05, 0.15)
 
+def _visible_chars(text: str) -> int:
+    """Non-whitespace character count; whitespace is what the editor normalizes (line breaks, nbsp)."""
+    return len(re.sub(r'\s', '', text))
+
+def _editor_visible_chars(driver, el) -> int:
+    """The editor's non-whitespace character count, or -1 if it cannot be read."""
+    try:
+        return int(driver.execute_script("return (arguments[0].innerText || '').replace(/\\s/g, '').length;", el) or 0)
+    except Exception:
+        return -1
+
+def enter_text_checkpointed(driver, el, text: str):
+    """Type a long body chunk by chunk, checking after each chunk that the editor holds everything sent so far.
+
+    A chunk that was dropped entirely is typed once more; any other shortfall raises, so a note that is
+    going wrong stops at that chunk instead of after the whole body (the in-flight record covers the rest).
+    """
+    _focus_and_clear(driver, el)
+    checkpoint = 0  # visible characters confirmed in the editor
+    for start in range(0, len(text), LARGE_NOTE_CHUNK_CHARS):
+        chunk = text[start:start + LARGE_NOTE_CHUNK_CHARS]
+        expected = checkpoint + _visible_chars(chunk)
+        for attempt in range(2):
+            if not cdp_insert_text(driver, chunk):
+                for piece_start in range(0, len(chunk), 200):
+                    el.send_keys(chunk[piece_start:piece_start + 200])
+                    short_sleep(0.01, 0.03)
+            settle_until = time.time() + CHUNK_SETTLE_SECONDS
+            have = _editor_visible_chars(driver, el)
+            while 0 <= have < expected and time.time() < settle_until:
+                time.sleep(0.2)
+                have = _editor_visible_chars(driver, el)
+            if have != checkpoint or expected == checkpoint:
+                break
+            debug_log(f"Chunk at {start} did not reach the editor; retyping it.")
+        if have < 0:
+            debug_log('Editor text length unavailable; continuing without checkpoints.')
+        elif have < expected:
+            raise RuntimeError(f"Body entry stalled at character {start} of {len(text)} "
+                               f"({have} of {expected} visible characters in the editor)")
+        checkpoint = expected
+        debug_log(f"Body checkpoint: {min(start + len(chunk), len(text))}/{len(text)} characters.")
+    short_sleep(0.05, 0.15)
+
+def discard_open_note(driver, editor) -> None:
+    """Best effort: empty the open composer and close it, so Keep drops the note instead of saving it."""
+    try:
+        _focus_and_clear(driver, editor)
+        title_input = get_title_input(driver)
+        if title_input is not None:
+            _focus_and_clear(driver, title_input)
+        close_note(driver)
+        debug_log('Discarded the partly typed note.')
+    except Exception as e:
+        debug_log(f"Could not discard the partly typed note: {e}")
+
 def set_pinned_state(driver, should_pin: bool):
     try:
         pin_btn = WebDriverWait(driver, 5).until(
@@ -566,7 +985,7 @@ def set_color(driver, color_key: str):
         short_sleep()
         # Pick color by aria-label
         opt = WebDriverWait(driver, 5).until(
-            EC.element_to_be_clickable((By.XPATH, f"//div[@role='menuitem' or @role='button'][@aria-label='{keep_color}']"))
+            EC.element_to_be_clickable((By.XPATH, f"//div[@role='menuitem' or @role='button'][@aria-label={_xpath_literal(keep_color)}]"))
         )
         opt.click()
         short_sleep()
@@ -683,109 +1102,1404 @@ def _xpath_literal(s: str) -> str:
         tokens.append("'" + p + "'")
     return "concat(" + ", ".join(tokens) + ")"
 
-def verify_note_present(driver, title: str, content: str, timeout: int = 12, refresh_once: bool = True) -> bool:
-    """Verify a note card with the given title/content snippet is visible on the main page."""
-    candidates = []
-    if title and title.strip():
-        candidates.append(title.strip()[:60])
-    if content and content.strip():
-        candidates.append(content.strip()[:60])
+# Keep's search route; navigating by hash avoids a page reload and the search box round trips
+KEEP_SEARCH_HASH = '#search/text='
+SEARCH_POLL_SECONDS = 1.5
+
+# query -> found, for the current account state; cleared whenever a note is created
+_search_cache: Dict[str, bool] = {}
+
+def invalidate_search_cache() -> None:
+    _search_cache.clear()
+
+def _find_in_main(driver, queries: List[str]) -> int:
+    """Index of the first query visible in the main region, or -1. One browser call for all queries."""
+    body = (
+        "const m = document.querySelector('div[role=\"main\"]');"
+        "if (!m) return -1;"
+        "const text = m.textContent.replace(/\\s+/g, ' ');"
+        "return arguments[0].findIndex((q) => text.includes(q.replace(/\\s+/g, ' ')));"
+    )
+    ok, idx = cdp_evaluate(driver, body, queries)
+    if not ok:
+        try:
+            idx = driver.execute_script(body, queries)
+        except Exception:
+            return -1
+    return idx if isinstance(idx, int) else -1
+
+def _verify_via_search_route(driver, queries: List[str]) -> bool:
+    """Open Keep's search route per query and check every query against each result page."""
+    if any(_search_cache.get(q) for q in queries):
+        return True
+    pending = [q for q in queries if q not in _search_cache]
+    if not pending:
+        return False
+    try:
+        for q in pending:
+            driver.execute_script(
+                "window.location.hash = arguments[0] + encodeURIComponent(arguments[1]);", KEEP_SEARCH_HASH, q
+            )
+            end = time.time() + SEARCH_POLL_SECONDS
+            while time.time() < end:
+                idx = _find_in_main(driver, pending)
+                if idx >= 0:
+                    _search_cache[pending[idx]] = True
+                    debug_log(f"Verified via search route: {pending[idx]!r}")
+                    return True
+                time.sleep(0.15)
+            _search_cache[q] = False
+        return False
+    except Exception as e:
+        debug_log(f"Search route verification failed: {e}")
+        return False
+    finally:
+        try:
+            driver.execute_script("window.location.hash = '#home';")
+        except Exception:
+            pass
+
+def _opening_snippets(title: str, content: str) -> List[str]:
+    """Default verification snippets: the first 60 characters of title and body (what cards show)."""
+    return [text.strip()[:60] for text in (title, content) if text and text.strip()]
+
+def verify_note_by_search(driver, search: str, confirm: List[str]) -> bool:
+    """Run Keep's search for `search` and check a result card shows one of the `confirm` snippets.
+
+    Search covers a note's full text, so `search` can come from anywhere in the body; the hit is
+    confirmed by text the cards do show (title or body opening).
+    """
+    if not confirm:
+        return False
+    try:
+        driver.execute_script(
+            "window.location.hash = arguments[0] + encodeURIComponent(arguments[1]);", KEEP_SEARCH_HASH, search
+        )
+        end = time.time() + SEARCH_POLL_SECONDS
+        while time.time() < end:
+            if _find_in_main(driver, confirm) >= 0:
+                debug_log(f"Verified via search for {search!r}")
+                return True
+            time.sleep(0.15)
+        return False
+    except Exception as e:
+        debug_log(f"Search verification failed: {e}")
+        return False
+    finally:
+        try:
+            driver.execute_script("window.location.hash = '#home';")
+        except Exception:
+            pass
+
+def verify_note_present(driver, title: str, content: str, timeout: int = 6,
+                        queries: Optional[List[str]] = None) -> bool:
+    """Verify a note card with the given title/content snippet is visible on the main page or in search.
+
+    `queries` replaces the default snippets (the first 60 characters of title and body).
+    """
+    candidates = list(queries or []) or _opening_snippets(title, content)
     # dedupe while preserving order
     seen = set()
     queries = [q for q in candidates if not (q in seen or seen.add(q))]
     if not queries:
         return False
 
-    def search_once(q: str) -> bool:
-        try:
-            xp = f"//div[@role='main']//*[contains(normalize-space(), {_xpath_literal(q)})]"
-            els = driver.find_elements(By.XPATH, xp)
-            return len(els) > 0
-        except Exception:
-            return False
-
-    # Try each query with live DOM wait
+    # Live grid first: a freshly closed note usually shows up here within a second
     end = time.time() + timeout
-    while time.time() < end:
-        for q in queries:
-            if search_once(q):
-                debug_log(f"Verified note appears with text snippet: {q!r}")
-                return True
+    while True:
+        idx = _find_in_main(driver, queries)
+        if idx >= 0:
+            debug_log(f"Verified note appears with text snippet: {queries[idx]!r}")
+            return True
+        if time.time() >= end:
+            break
         short_sleep(0.2, 0.5)
 
-    # Refresh once and retry
-    if refresh_once:
+    # Fallback: Keep's search route (also covers notes scrolled out of the grid)
+    if _verify_via_search_route(driver, queries):
+        return True
+    debug_log(f"Could not verify note presence for any of: {queries!r}")
+    return False
+
+def create_note_ui(driver, title: str, content: str, items: List[Dict[str, Any]], color_key: str,
+                   is_pinned: bool, is_archived: bool, labels: List[str], large: bool = False) -> None:
+    """Create one note through individual Selenium steps; raises if the composer cannot be opened.
+
+    With large=True the body is typed in verified chunks, and a stalled chunk raises.
+    """
+    t = time.time()
+    # Decide note type: checklist if listContent present, else text note
+    if items:
+        if not start_new_list_note(driver):
+            # fallback to text note
+            if not open_compact_composer(driver):
+                raise RuntimeError('Cannot open composer')
+    else:
+        if not open_compact_composer(driver):
+            raise RuntimeError('Cannot open composer')
+    t = observe_step('open_composer', t)
+
+    # Expand editor first to ensure title is present
+    editor = None
+    try:
+        editor = get_content_editor(driver)
+    except Exception:
+        pass
+    # Click editor to fully expand title region
+    try:
+        if editor is not None:
+            editor.click()
+            short_sleep(0.05, 0.12)
+    except Exception:
+        pass
+    # Click the editor to fully expand header/title region
+    try:
+        if editor is not None:
+            editor.click()
+            short_sleep(0.05, 0.12)
+    except Exception:
+        pass
+
+    t = observe_step('expand_editor', t)
+
+    # Fill title (after editor presence to ensure expanded UI)
+    try:
+        if title:
+            title_input = get_title_input(driver)
+            _send_text_to_element(driver, title_input, title)
+    except Exception:
+        # As a fallback, focus body and SHIFT+TAB (try up to 3 times) to move to title, then type
+        if title and editor is not None:
+            try:
+                from selenium.webdriver.common.keys import Keys
+                editor.click()
+                short_sleep(0.05, 0.12)
+                success = False
+                for _ in range(3):
+                    try:
+                        editor.send_keys(Keys.SHIFT, Keys.TAB)
+                        short_sleep(0.1, 0.2)
+                        active = driver.switch_to.active_element
+                        aria = (active.get_attribute('aria-label') or '').lower()
+                        if 'title' in aria:
+                            _send_text_to_element(driver, active, title)
+                            success = True
+                            debug_log('Title entered via SHIFT+TAB fallback.')
+                            break
+                    except Exception:
+                        continue
+                if not success:
+                    debug_log('Title entry SHIFT+TAB fallback did not succeed.')
+            except Exception:
+                debug_log('Title entry fallback failed.')
+
+    t = observe_step('title', t)
+
+    # Fill body content or checklist items
+    if large and content and not items:
+        # Raises on a stalled chunk: a half-typed long note must not be saved as if complete
+        if editor is None:
+            editor = get_content_editor(driver)
         try:
-            driver.refresh()
-            short_sleep(1.0, 1.6)
+            enter_text_checkpointed(driver, editor, content)
         except Exception:
-            pass
-        end = time.time() + max(4, timeout // 2)
-        while time.time() < end:
-            for q in queries:
-                if search_once(q):
-                    debug_log(f"Verified after refresh: {q!r}")
-                    return True
-            short_sleep(0.2, 0.5)
+            discard_open_note(driver, editor)
+            raise
+    else:
+        try:
+            if editor is None:
+                editor = get_content_editor(driver)
+            if items:
+                # Add checklist items
+                from selenium.webdriver.common.keys import Keys
+                for it in items:
+                    text = it.get('text', '') or ''
+                    if not text:
+                        continue
+                    editor.click()
+                    if not cdp_insert_text(driver, text):
+                        editor.send_keys(text)
+                    editor.send_keys(Keys.ENTER)
+                    short_sleep(0.05, 0.15)
+                # Checked state is difficult to set reliably via UI; best-effort omitted
+            else:
+                if content:
+                    _send_text_to_element(driver, editor, content)
+        except Exception as body_err:
+            debug_log(f"Error entering body content: {body_err}")
+    observe_step('body', t)
+    finish_note_ui(driver, labels, color_key, is_pinned, is_archived)
+
+def finish_note_ui(driver, labels: List[str], color_key: str, is_pinned: bool, is_archived: bool) -> None:
+    """The steps after the body for the note open in the composer: labels, attributes, close."""
+    t = time.time()
+    if labels:
+        add_labels(driver, labels)
+        t = observe_step('labels', t)
+
+    # Pin, color and archive in one batched call (archiving usually closes the note)
+    archived_closed = apply_note_attributes(driver, is_pinned, color_key, is_archived)
+    t = observe_step('attributes', t)
+    if not archived_closed:
+        close_note(driver)
+        observe_step('close', t)
+
+# --- In-page agent ---
+
+# Bump when KEEP_AGENT_JS changes so a page holding an older copy gets re-injected.
+AGENT_VERSION = 5
+AGENT_SCRIPT_TIMEOUT = 90  # seconds for one agent call (createNote is the longest)
+# Failure steps after which nothing has been typed yet, so the Selenium path can safely take over
+AGENT_FALLBACK_STEPS = ('inject', 'open_composer')
+# Failure steps that leave the note open with its content in place; Selenium finishes it from there
+AGENT_FINISH_STEPS = ('labels', 'pin', 'color')
+
+KEEP_AGENT_JS = r"""
+(function (version) {
+  if (window.__keepImportAgent && window.__keepImportAgent.version === version) return;
+  const sleep = (ms) => new Promise((r) => setTimeout(r, ms));
+  const visible = (el) => !!el && el.getClientRects().length > 0;
+  function first(sels, root) {
+    for (const sel of sels) {
+      for (const el of (root || document).querySelectorAll(sel)) {
+        if (visible(el)) return el;
+      }
+    }
+    return null;
+  }
+  async function waitFor(fn, timeout) {
+    const end = Date.now() + (timeout || 5000);
+    while (Date.now() < end) {
+      const v = fn();
+      if (v) return v;
+      await sleep(50);
+    }
+    return null;
+  }
+  function press(el) {
+    for (const type of ['mousedown', 'mouseup']) {
+      el.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+    }
+    el.click();
+  }
+  function key(el, name, code) {
+    for (const type of ['keydown', 'keyup']) {
+      el.dispatchEvent(new KeyboardEvent(type, {key: name, code: name, keyCode: code, which: code, bubbles: true}));
+    }
+  }
+  function typeInto(el, text) {
+    el.focus();
+    document.execCommand('selectAll', false, null);
+    document.execCommand('insertText', false, text);
+    const now = (el.isContentEditable ? el.innerText : el.value) || '';
+    if (now.trim() !== text.trim()) {
+      if (el.isContentEditable) el.innerText = text; else el.value = text;
+      el.dispatchEvent(new InputEvent('input', {bubbles: true}));
+    }
+  }
+  const norm = (text) => (text || '').replace(/\s+/g, ' ').trim();
+  // Smallest ancestor of the editor that also holds the note toolbar
+  function scopeOf(editor) {
+    let n = editor;
+    while (n && !n.querySelector('[aria-label="Background options"]')) n = n.parentElement;
+    return n || document;
+  }
+  const EDITOR = ['div[aria-label="Note"]', 'div[role="textbox"]', 'div[contenteditable="true"]'];
+  const COMPOSER = ['div[role="button"][aria-label^="Take a note"]', '[aria-label^="Take a note"]'];
+  const NEW_LIST = ['div[aria-label="New list"]', 'button[aria-label="New list"]', 'div[aria-label^="New list"]'];
+  const TITLE = ['div[contenteditable="true"][aria-label="Title"]', 'input[aria-label*="Title" i]',
+                 'input[placeholder*="Title" i]', 'div[contenteditable="true"][aria-label*="Title" i]'];
+
+  // Pin, colour and archive in one pass; the returned state is read back from the DOM afterwards
+  async function applyAttributes(spec, editor) {
+    editor = editor || first(EDITOR);
+    if (!editor) return {ok: false, step: 'attributes', error: 'no open note'};
+    const scope = scopeOf(editor);
+    const pinButton = () => first(['[aria-label*="Pin note"]', '[aria-label*="Unpin note"]'], scope);
+    const state = {ok: true, pinned: false, color: false, archived: false};
+    const colorOption = () => Array.from(document.querySelectorAll('[role="menuitem"], [role="button"], [role="radio"]'))
+      .find((el) => el.getAttribute('aria-label') === spec.color && visible(el));
+    const colorChecked = () => {
+      const opt = colorOption();
+      return !!opt && (opt.getAttribute('aria-checked') === 'true' || opt.getAttribute('aria-selected') === 'true');
+    };
+    if (spec.pinned) {
+      const pin = await waitFor(pinButton, 3000);
+      if (pin && (pin.getAttribute('aria-label') || '').indexOf('Unpin') < 0) press(pin);
+    }
+    if (spec.color) {
+      const palette = first(['[aria-label="Background options"]'], scope);
+      if (palette) {
+        press(palette);
+        const opt = await waitFor(colorOption, 3000);
+        if (opt) {
+          press(opt);
+          // Confirm from the palette's checked state; reopen it if the click closed it
+          let confirmed = await waitFor(colorChecked, 1500);
+          if (!confirmed && !colorOption()) {
+            press(palette);
+            confirmed = await waitFor(colorChecked, 1500);
+          }
+          state.color = !!confirmed;
+        }
+        key(document.activeElement || document.body, 'Escape', 27);
+      }
+    }
+    await sleep(50);
+    const pin = pinButton();
+    state.pinned = !!pin && (pin.getAttribute('aria-label') || '').indexOf('Unpin') >= 0;
+    if (spec.archived) {
+      const archive = first(['[aria-label="Archive"]'], scope);
+      if (archive) {
+        press(archive);
+        state.archived = !!(await waitFor(() => !visible(editor) || !document.contains(editor), 4000));
+      }
+    }
+    return state;
+  }
+
+  function listRows(scope) {
+    return Array.from(scope.querySelectorAll('[role="checkbox"]'))
+      .map((cb) => norm((cb.closest('[role="listitem"]') || cb.parentElement || {}).innerText))
+      .filter(Boolean);
+  }
+  function labelChips(scope) {
+    return Array.from(scope.querySelectorAll('a[href*="#label/"]'))
+      .map((a) => decodeURIComponent(a.getAttribute('href').split('#label/')[1] || ''));
+  }
+  // Move a half-built note to the trash so it can be recreated from scratch
+  async function discard(scope) {
+    const more = first(['[aria-label*="More"]'], scope);
+    if (!more) return false;
+    press(more);
+    const del = await waitFor(() => Array.from(document.querySelectorAll('div[role="menuitem"]'))
+      .find((el) => visible(el) && /delete/i.test(el.textContent)), 3000);
+    if (!del) return false;
+    press(del);
+    return true;
+  }
+
+  async function createNote(spec) {
+    let step = 'open_composer';
+    try {
+      const opener = (spec.items && spec.items.length && first(NEW_LIST)) || first(COMPOSER);
+      if (!opener) return {ok: false, step, error: 'composer not found'};
+      press(opener);
+      const editor = await waitFor(() => first(EDITOR), 6000);
+      if (!editor) return {ok: false, step, error: 'editor did not appear'};
+      press(editor);
+      const scope = scopeOf(editor);
+
+      if (spec.title) {
+        step = 'title';
+        const titleEl = await waitFor(() => first(TITLE, scope) || first(TITLE), 4000);
+        if (!titleEl) return {ok: false, step, error: 'title field not found'};
+        typeInto(titleEl, spec.title);
+      }
+
+      if (spec.items && spec.items.length) {
+        step = 'items';
+        for (const [i, text] of spec.items.entries()) {
+          const row = document.activeElement && document.activeElement.isContentEditable
+            && document.activeElement !== first(TITLE, scope) ? document.activeElement : editor;
+          row.focus();
+          document.execCommand('insertText', false, text);
+          // A synthetic Enter keydown is untrusted and does nothing; insertParagraph is a real edit
+          if (i < spec.items.length - 1) document.execCommand('insertParagraph', false, null);
+          await sleep(30);
+        }
+        const want = spec.items.map(norm);
+        const rows = await waitFor(() => {
+          const got = listRows(scope);
+          return want.every((t, i) => got[i] === t) ? got : null;
+        }, 2000);
+        if (!rows) {
+          return {ok: false, step, error: `checklist read back as ${JSON.stringify(listRows(scope))}`,
+                  discarded: await discard(scope)};
+        }
+      } else if (spec.text) {
+        step = 'body';
+        typeInto(editor, spec.text);
+      }
+
+      if (spec.labels && spec.labels.length) {
+        step = 'labels';
+        const more = first(['[aria-label*="More"]'], scope);
+        if (!more) return {ok: false, step, error: 'More button not found', missing: spec.labels};
+        press(more);
+        const item = await waitFor(() => Array.from(document.querySelectorAll('div[role="menuitem"]'))
+          .find((el) => visible(el) && /label/i.test(el.textContent)), 3000);
+        if (!item) return {ok: false, step, error: 'label menu item not found', missing: spec.labels};
+        press(item);
+        const input = await waitFor(() => first(['input[aria-label*="Label"]', 'input[type="text"]']), 3000);
+        if (!input) return {ok: false, step, error: 'label input not found', missing: spec.labels};
+        for (const name of spec.labels) {
+          input.focus();
+          input.value = name;
+          input.dispatchEvent(new InputEvent('input', {bubbles: true}));
+          // Tick the matching label, or click "Create ..." for a new one (Enter would be untrusted)
+          const option = await waitFor(() =>
+            first([`[role="checkbox"][aria-label="${CSS.escape(name)}"]`])
+            || Array.from(document.querySelectorAll('[role="button"], [role="option"], div'))
+              .find((el) => visible(el) && el.children.length <= 2 && /^\s*\+?\s*create\b/i.test(el.textContent)
+                    && el.textContent.indexOf(name) >= 0), 2000);
+          if (option && option.getAttribute('aria-checked') !== 'true') press(option);
+          await sleep(150);
+        }
+        key(input, 'Escape', 27);
+        const missing = () => spec.labels.filter((name) => labelChips(scope).indexOf(name) < 0);
+        if (!(await waitFor(() => missing().length === 0, 2000))) {
+          const left = missing();
+          return {ok: false, step, error: `label(s) not applied: ${left.join(', ')}`, missing: left};
+        }
+      }
+
+      step = 'attributes';
+      const state = await applyAttributes(spec, editor);
+      if (spec.color && !state.color) {
+        return {ok: false, step: 'color', error: 'colour not confirmed', archived: state.archived};
+      }
+      if (spec.pinned && !spec.archived && !state.pinned) return {ok: false, step: 'pin', error: 'pin not confirmed'};
+      if (spec.archived) {
+        if (!state.archived) return {ok: false, step: 'archive', error: 'note did not close after archiving'};
+        return {ok: true, step: 'done', archived: true};
+      }
+      step = 'close';
+      const closer = first(['[aria-label="Close"]', '[data-tooltip="Close"]', 'div[data-tooltip-text="Done"]',
+                            '[aria-label*="Done" i]', '[aria-label*="Close" i]'], scope);
+      if (!closer) return {ok: false, step, error: 'button not found'};
+      press(closer);
+      const gone = await waitFor(() => !visible(editor) || !document.contains(editor), 5000);
+      if (!gone) return {ok: false, step, error: 'editor still open'};
+      return {ok: true, step: 'done', archived: false};
+    } catch (e) {
+      return {ok: false, step, error: String(e)};
+    }
+  }
+
+  window.__keepImportAgent = {version, createNote, applyAttributes};
+})(arguments[0]);
+"""
+
+def call_agent(driver, method: str, arg: Dict[str, Any]) -> Dict[str, Any]:
+    """Call window.__keepImportAgent[method](arg) with one async script call and return its result dict.
+
+    The agent is (re)injected lazily, so a page reload costs one extra call, not one per note.
+    """
+    script = (
+        "const done = arguments[arguments.length - 1];"
+        "const agent = window.__keepImportAgent;"
+        "if (!agent || agent.version !== arguments[2]) { done({ok: false, step: 'inject'}); return; }"
+        "agent[arguments[0]](arguments[1]).then(done, (e) => done({ok: false, step: 'exception', error: String(e)}));"
+    )
+    result: Dict[str, Any] = {'ok': False, 'step': 'inject'}
+    for attempt in range(2):
+        result = driver.execute_async_script(script, method, arg, AGENT_VERSION) or {'ok': False, 'step': 'no_result'}
+        if result.get('step') != 'inject' or attempt:
+            break
+        driver.execute_script(KEEP_AGENT_JS, AGENT_VERSION)
+        debug_log('Injected in-page agent.')
+    debug_log(f"Agent {method} result: {result}")
+    return result
+
+def create_note_with_agent(driver, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Create a whole note inside the page with one async script call.
+
+    spec: {title, text, items: [str], color: Keep color label or None, pinned, archived, labels: [str]}.
+    Returns the agent's result: {'ok': True, ...} or {'ok': False, 'step': <failed step>, 'error': ...};
+    a 'labels' failure also lists the labels still missing from the note under 'missing'.
+    """
+    return call_agent(driver, 'createNote', spec)
+
+def apply_note_attributes(driver, should_pin: bool, color_key: str, should_archive: bool) -> bool:
+    """Apply pin/color/archive to the open note in one in-page call; returns True if archiving closed it.
+
+    The default case (unpinned, default color, not archived) costs no browser calls at all. Anything the
+    batched call could not confirm is retried with the individual set_* helpers.
+    """
+    keep_color = COLOR_MAP.get((color_key or '').upper())
+    if not should_pin and not keep_color and not should_archive:
+        return False
+    try:
+        state = call_agent(driver, 'applyAttributes', {
+            'pinned': should_pin,
+            'color': keep_color,
+            'archived': should_archive,
+        })
+    except Exception as e:
+        debug_log(f"Batched attribute call failed: {e}")
+        state = {}
+    if state.get('archived'):
+        # The note closed on archiving, so there is nothing left to pin or colour
+        if keep_color and not state.get('color'):
+            debug_log('Colour of the archived note was not confirmed.')
+        return True
+    if should_pin and not state.get('pinned'):
+        set_pinned_state(driver, True)
+    if keep_color and not state.get('color'):
+        set_color(driver, color_key)
+    if should_archive:
+        return set_archive_state(driver, True)
+    return False
 
-    # Fallback: use Keep's search to look for the note
+# --- Reconciliation ---
+
+# Grid cards only show the start of a body, so source notes and cards are matched on a hash of the
+# first CARD_TEXT_PREFIX characters of "title body" (whitespace-collapsed, case-folded).
+CARD_TEXT_PREFIX = 120
+# Scroll steps with nothing new at the bottom of the grid before a view counts as fully scraped
+RECONCILE_STALL_STEPS = 3
+# Card backgrounds that mean "no color" (light and dark theme)
+DEFAULT_CARD_BACKGROUNDS = ('', 'transparent', 'rgba(0, 0, 0, 0)', 'rgb(255, 255, 255)', 'rgb(32, 33, 36)')
+# Card backgrounds per Keep colour label (COLOR_MAP values): current light palette, dark theme, older light palette
+KEEP_CARD_COLORS = {
+    'Red': ('#faafa8', '#77172e', '#f28b82'),
+    'Orange': ('#f39f76', '#692b17', '#fbbc04'),
+    'Yellow': ('#fff8b8', '#7c4a03', '#fff475'),
+    'Green': ('#e2f6d3', '#264d3b', '#ccff90'),
+    'Teal': ('#b4ddd3', '#0c625d', '#a7ffeb'),
+    'Blue': ('#d4e4ed', '#256377', '#cbf0f8'),
+    'Dark Blue': ('#aeccdc', '#284255', '#aecbfa'),
+    'Purple': ('#d3bfdb', '#472e5b', '#d7aefb'),
+    'Pink': ('#f6e2dd', '#6c394f', '#fdcfe8'),
+    'Brown': ('#e9e3d4', '#4b443a', '#e6c9a8'),
+    'Gray': ('#efeff1', '#232427', '#e8eaed'),
+}
+CARD_COLOR_TOLERANCE = 24  # max RGB distance for a background to count as a palette colour
+
+# Rendered grid cards. Cards are keyed by their position in the masonry layout, which survives
+# virtualization, so re-rendered cards are not counted twice.
+GRID_CARDS_JS = r"""
+const PIN = '[aria-label*="Pin note"], [aria-label*="Unpin note"]';
+const main = document.querySelector('div[role="main"]') || document.body;
+const scroller = document.scrollingElement || document.documentElement;
+function gridCards() {
+  const found = [];
+  for (const pin of main.querySelectorAll(PIN)) {
+    // Largest ancestor that still holds only this card's pin button
+    let card = pin;
+    while (card.parentElement && card.parentElement !== main && card.parentElement.querySelectorAll(PIN).length === 1) {
+      card = card.parentElement;
+    }
+    const rect = card.getBoundingClientRect();
+    if (!rect.width || !rect.height) continue;
+    found.push({card, pin, key: Math.round(rect.top + scroller.scrollTop) + ':' + Math.round(rect.left)});
+  }
+  return found;
+}
+"""
+
+# Extracts every rendered card; scrolls one step afterwards when arguments[0] is true.
+GRID_SCRAPE_JS = GRID_CARDS_JS + r"""
+const cards = [];
+for (const {card, pin, key} of gridCards()) {
+  const blocks = Array.from(card.querySelectorAll('div[contenteditable="false"]'))
+    .map((el) => (el.innerText || '').trim()).filter(Boolean);
+  let bg = '';
+  for (let el = card; el && !bg; el = el.firstElementChild) {
+    const c = getComputedStyle(el).backgroundColor;
+    if (c && c !== 'rgba(0, 0, 0, 0)' && c !== 'transparent') bg = c;
+  }
+  cards.push({
+    key: key,
+    title: blocks.length > 1 ? blocks[0] : '',
+    body: blocks.length > 1 ? blocks.slice(1).join('\n') : (blocks[0] || (card.innerText || '').trim()),
+    pinned: (pin.getAttribute('aria-label') || '').indexOf('Unpin') >= 0,
+    background: bg,
+    labels: Array.from(card.querySelectorAll('a[href*="#label/"]'))
+      .map((a) => decodeURIComponent(a.getAttribute('href').split('#label/')[1] || '')).filter(Boolean),
+  });
+}
+const atEnd = scroller.scrollTop + window.innerHeight >= scroller.scrollHeight - 2;
+if (arguments[0]) scroller.scrollBy(0, Math.round(window.innerHeight * 0.8));
+return {cards: cards, atEnd: atEnd};
+"""
+
+def card_color_label(background: str) -> Optional[str]:
+    """Keep colour label of a card background ('' for the default background, None if unrecognised)."""
+    if background in DEFAULT_CARD_BACKGROUNDS:
+        return ''
+    m = re.match(r'rgba?\((\d+),\s*(\d+),\s*(\d+)', background or '')
+    if not m:
+        return None
+    rgb = tuple(int(v) for v in m.groups())
+    best, best_dist = None, CARD_COLOR_TOLERANCE + 1
+    for label, hexes in KEEP_CARD_COLORS.items():
+        for h in hexes:
+            dist = max(abs(a - int(h[i:i + 2], 16)) for a, i in zip(rgb, (1, 3, 5)))
+            if dist < best_dist:
+                best, best_dist = label, dist
+    return best
+
+def _same_text(card_text: str, source_text: str) -> bool:
+    """Card text matches the source (whitespace-collapsed); cards may cut long text short, with or without an ellipsis."""
+    shown = ' '.join(card_text.split()).rstrip('…').rstrip()
+    full = ' '.join(source_text.split())
+    return shown == full or (len(shown) < len(full) and full.startswith(shown))
+
+def card_content_key(title: str, body: str) -> str:
+    text = ' '.join(f"{title} {body}".split()).casefold()[:CARD_TEXT_PREFIX]
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def open_note_db(path: str = RECONCILE_DB_PATH) -> sqlite3.Connection:
+    """Account snapshot; each --reconcile replaces the previous one. `color` is the Keep label, NULL if unrecognised."""
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE IF EXISTS keep_cards")
+    conn.execute(
+        "CREATE TABLE keep_cards ("
+        " card_key TEXT PRIMARY KEY, view TEXT, title TEXT, body TEXT, content_key TEXT,"
+        " background TEXT, color TEXT, pinned INTEGER, archived INTEGER, labels TEXT, scraped_ts INTEGER)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS keep_cards_content ON keep_cards(content_key)")
+    return conn
+
+def scrape_view(driver, conn: sqlite3.Connection, view: str) -> int:
+    """Scroll one Keep view (home/archive) top to bottom, upserting every card; returns cards seen."""
+    driver.execute_script("window.location.hash = arguments[0]; (document.scrollingElement || document.documentElement).scrollTo(0, 0);", f"#{view}")
+    time.sleep(1.0)  # let the first batch of cards render
+    seen = set()
+    stalled = 0
+    while stalled < RECONCILE_STALL_STEPS:
+        res = driver.execute_script(GRID_SCRAPE_JS, True) or {}
+        now = int(time.time())
+        rows = []
+        for c in res.get('cards') or []:
+            key = f"{view}:{c['key']}"
+            if key in seen:
+                continue
+            seen.add(key)
+            bg = c.get('background') or ''
+            rows.append((
+                key, view, c.get('title') or '', c.get('body') or '', card_content_key(c.get('title') or '', c.get('body') or ''),
+                bg, card_color_label(bg), int(bool(c.get('pinned'))), int(view == 'archive'),
+                json.dumps(sorted(c.get('labels') or []), ensure_ascii=False), now,
+            ))
+        if rows:
+            conn.executemany("INSERT OR REPLACE INTO keep_cards VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+            conn.commit()
+        stalled = stalled + 1 if res.get('atEnd') and not rows else 0
+        time.sleep(0.25)
+    debug_log(f"Scraped {len(seen)} card(s) from #{view}.")
+    return len(seen)
+
+def reconcile(driver, json_files: List[str], db_path: str = RECONCILE_DB_PATH,
+              report_path: str = RECONCILE_REPORT_PATH) -> Dict[str, Any]:
+    """Scrape the whole account into SQLite and diff it against the source corpus; writes a JSON report."""
+    conn = open_note_db(db_path)
     try:
-        from selenium.webdriver.common.keys import Keys
-        search_box = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, 'input[aria-label*="Search" i], input[placeholder*="Search" i]'))
-        )
-        for q in queries:
+        total_cards = sum(scrape_view(driver, conn, view) for view in ('home', 'archive'))
+        driver.execute_script("window.location.hash = '#home';")
+
+        conn.execute("CREATE TEMP TABLE source_keys (content_key TEXT)")
+        report: Dict[str, Any] = {
+            'generated': int(time.time()),
+            'source_notes': 0,
+            'keep_cards': total_cards,
+            'missing': [],
+            'mismatched': [],
+            'duplicates': [],
+        }
+        source_counts: Dict[str, int] = {}
+        sources = []
+        for file_path in json_files:
             try:
-                search_box.click()
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    note = parse_note(json.load(f))
             except Exception:
-                driver.execute_script("arguments[0].click();", search_box)
-            search_box.clear()
-            search_box.send_keys(q)
-            short_sleep(0.3, 0.6)
-            xp = f"//div[@role='main']//*[contains(normalize-space(), {_xpath_literal(q)})]"
-            end = time.time() + 6
-            while time.time() < end:
-                els = driver.find_elements(By.XPATH, xp)
-                if els:
-                    debug_log(f"Verified via search: {q!r}")
-                    search_box.send_keys(Keys.ESCAPE)
-                    short_sleep(0.2, 0.4)
-                    return True
-                short_sleep(0.2, 0.4)
-            # clear for next query
-            search_box.send_keys(Keys.ESCAPE)
-            short_sleep(0.2, 0.4)
+                continue
+            body = note['content'] or '\n'.join(it.get('text', '') for it in note['items'])
+            if not note['title'] and not body:
+                continue
+            key = card_content_key(note['title'], body)
+            source_counts[key] = source_counts.get(key, 0) + 1
+            sources.append((os.path.basename(file_path), note, key))
+            conn.execute("INSERT INTO source_keys VALUES (?)", (key,))
+        report['source_notes'] = len(sources)
+
+        for filename, note, key in sources:
+            cards = conn.execute(
+                "SELECT title, body, background, color, pinned, archived, labels FROM keep_cards WHERE content_key = ?", (key,)
+            ).fetchall()
+            ref = {'file': filename, 'title': note['title']}
+            if not cards and note['title'].strip():
+                # Same title but different opening text: a body mismatch, not a missing note
+                cards = conn.execute(
+                    "SELECT title, body, background, color, pinned, archived, labels FROM keep_cards"
+                    " WHERE title = ? AND content_key NOT IN (SELECT content_key FROM source_keys)", (note['title'].strip(),)
+                ).fetchall()
+            if not cards:
+                report['missing'].append(ref)
+                continue
+            if len(cards) > source_counts[key]:
+                report['duplicates'].append(dict(ref, copies=len(cards)))
+            best: Dict[str, Any] = {}
+            want_color = COLOR_MAP.get(note['color_key'].upper()) or ''
+            source_body = note['content'] or '\n'.join(it.get('text', '') for it in note['items'])
+            for title, body, background, color, pinned, archived, labels in cards:
+                diff: Dict[str, Any] = {}
+                if not title and not source_body:
+                    title, body = body, ''  # a title-only card renders a single text block
+                if not _same_text(title, note['title']):
+                    diff['title'] = [note['title'], title]
+                if not _same_text(body, source_body):
+                    diff['body'] = True
+                if color != want_color:
+                    diff['color'] = [want_color or 'DEFAULT', color if color is not None else background]
+                if bool(archived) != note['is_archived']:
+                    diff['archived'] = [note['is_archived'], bool(archived)]
+                elif not archived and bool(pinned) != note['is_pinned']:
+                    diff['pinned'] = [note['is_pinned'], bool(pinned)]
+                missing_labels = sorted(set(note['labels']) - set(json.loads(labels)))
+                if missing_labels:
+                    diff['missing_labels'] = missing_labels
+                if not diff:
+                    best = {}
+                    break
+                if not best or len(diff) < len(best):
+                    best = diff
+            if best:
+                report['mismatched'].append(dict(ref, fields=best))
+
+        report['unmatched_cards'] = conn.execute(
+            "SELECT COUNT(*) FROM keep_cards WHERE content_key NOT IN (SELECT content_key FROM source_keys)"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+    tmp_path = report_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, report_path)
+    return report
+
+# --- Export ---
+
+EXPORT_MANIFEST_NAME = 'export_manifest.db'
+
+OPEN_CARD_JS = GRID_CARDS_JS + r"""
+const hit = gridCards().find((c) => c.key === arguments[0]);
+if (!hit) return false;
+(hit.card.querySelector('div[contenteditable="false"]') || hit.card).click();
+return true;
+"""
+
+# Reads the open note (async: the palette has to be opened to learn the color).
+# arguments[0] maps Keep color labels to Takeout color keys.
+EXPORT_NOTE_JS = r"""
+const done = arguments[arguments.length - 1];
+const colorKeys = arguments[0];
+const sleep = (ms) => new Promise((r) => setTimeout(r, ms));
+const visible = (el) => !!el && el.getClientRects().length > 0;
+(async () => {
+  let editor = null;
+  for (let i = 0; i < 80 && !editor; i++) {
+    editor = Array.from(document.querySelectorAll('[contenteditable="true"]')).find(visible) || null;
+    if (!editor) await sleep(50);
+  }
+  if (!editor) return done({error: 'note did not open'});
+  let scope = editor;
+  while (scope && !scope.querySelector('[aria-label="Background options"]')) scope = scope.parentElement;
+  scope = scope || document;
+  const titleEl = scope.querySelector('[contenteditable="true"][aria-label="Title"], input[aria-label*="Title" i]');
+  const title = titleEl ? ((titleEl.value !== undefined ? titleEl.value : titleEl.innerText) || '').trim() : '';
+  const items = [];
+  for (const cb of scope.querySelectorAll('[role="checkbox"]')) {
+    const row = cb.closest('[role="listitem"]') || cb.parentElement;
+    const textEl = row && row.querySelector('[contenteditable="true"]');
+    const text = ((textEl || row || {}).innerText || '').trim();
+    if (text) items.push({text: text, isChecked: cb.getAttribute('aria-checked') === 'true'});
+  }
+  const bodyEl = scope.querySelector('[contenteditable="true"][aria-label="Note"]')
+    || Array.from(scope.querySelectorAll('[contenteditable="true"]')).find((el) => el !== titleEl && visible(el));
+  const pin = scope.querySelector('[aria-label*="Pin note"], [aria-label*="Unpin note"]');
+  const labels = Array.from(scope.querySelectorAll('a[href*="#label/"]'))
+    .map((a) => decodeURIComponent(a.getAttribute('href').split('#label/')[1] || '')).filter(Boolean);
+  let color = 'DEFAULT';
+  const palette = scope.querySelector('[aria-label="Background options"]');
+  if (palette) {
+    palette.click();
+    await sleep(250);
+    const chosen = Array.from(document.querySelectorAll('[role="menuitem"], [role="button"], [role="radio"]'))
+      .find((el) => visible(el) && colorKeys[el.getAttribute('aria-label')]
+        && (el.getAttribute('aria-checked') === 'true' || el.getAttribute('aria-selected') === 'true'));
+    if (chosen) color = colorKeys[chosen.getAttribute('aria-label')];
+    document.body.dispatchEvent(new KeyboardEvent('keydown', {key: 'Escape', keyCode: 27, bubbles: true}));
+  }
+  done({
+    title: title,
+    text: items.length ? '' : ((bodyEl && bodyEl.innerText) || '').trim(),
+    items: items,
+    pinned: !!pin && (pin.getAttribute('aria-label') || '').indexOf('Unpin') >= 0,
+    labels: labels,
+    color: color,
+  });
+})().catch((e) => done({error: String(e)}));
+"""
+
+def open_export_manifest(export_dir: str) -> sqlite3.Connection:
+    """Exported notes, so an interrupted export resumes without rewriting (or holding) what it already has.
+
+    Rows are keyed by content, not by grid position: record_key hashes the written record (with an
+    occurrence ordinal from the second identical note in a view on, so copies are kept apart), and
+    content_key is the card preview hash used to recognise an exported note without opening it.
+    The temp tables hold what the current run has seen, so it stays on disk rather than in memory.
+    """
+    conn = sqlite3.connect(os.path.join(export_dir, EXPORT_MANIFEST_NAME))
+    conn.execute("PRAGMA temp_store = FILE")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS exported_notes ("
+        " view TEXT, record_key TEXT, content_key TEXT, file TEXT, ts INTEGER, PRIMARY KEY (view, record_key))"
+    )
+    # grid positions dealt with this run (exported, already exported, or failed)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS export_handled (view TEXT, card_key TEXT, PRIMARY KEY (view, card_key))")
+    # cards per preview hash seen this run, matched against earlier exports
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS export_previews (view TEXT, content_key TEXT, seen INTEGER, PRIMARY KEY (view, content_key))")
+    # notes per record hash opened this run: the occurrence ordinal of identical notes
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS export_records (view TEXT, record_hash TEXT, seen INTEGER, PRIMARY KEY (view, record_hash))")
+    return conn
+
+def takeout_record(note: Dict[str, Any], archived: bool) -> Dict[str, Any]:
+    """Shape an exported note like a Takeout Keep JSON file (importable by this script)."""
+    record: Dict[str, Any] = {
+        'color': note.get('color') or 'DEFAULT',
+        'isTrashed': False,
+        'isPinned': bool(note.get('pinned')) and not archived,
+        'isArchived': archived,
+        'title': note.get('title') or '',
+    }
+    if note.get('items'):
+        record['listContent'] = [{'text': it['text'], 'isChecked': bool(it.get('isChecked'))} for it in note['items']]
+    else:
+        record['textContent'] = note.get('text') or ''
+    if note.get('labels'):
+        record['labels'] = [{'name': name} for name in note['labels']]
+    return record
+
+def export_view(driver, conn: sqlite3.Connection, export_dir: str, view: str) -> int:
+    """Open and export every not-yet-exported card of one view; returns notes written."""
+    color_keys = {label: key for key, label in COLOR_MAP.items() if label}
+    color_keys['Default'] = 'DEFAULT'
+    driver.execute_script("window.location.hash = arguments[0]; (document.scrollingElement || document.documentElement).scrollTo(0, 0);", f"#{view}")
+    time.sleep(1.0)  # let the first batch of cards render
+    written = 0
+    stalled = 0
+    failed = 0
+    while stalled < RECONCILE_STALL_STEPS:
+        res = driver.execute_script(GRID_SCRAPE_JS, False) or {}
+        new_here = 0
+        for c in res.get('cards') or []:
+            if conn.execute("INSERT OR IGNORE INTO export_handled VALUES (?, ?)", (view, c['key'])).rowcount == 0:
+                continue
+            content_key = card_content_key(c.get('title') or '', c.get('body') or '')
+            conn.execute("INSERT OR IGNORE INTO export_previews VALUES (?, ?, 0)", (view, content_key))
+            conn.execute("UPDATE export_previews SET seen = seen + 1 WHERE view = ? AND content_key = ?", (view, content_key))
+            row = conn.execute(
+                "SELECT (SELECT COUNT(*) FROM exported_notes WHERE view = ? AND content_key = ?),"
+                " (SELECT seen FROM export_previews WHERE view = ? AND content_key = ?)",
+                (view, content_key, view, content_key),
+            ).fetchone()
+            if row[0] >= row[1]:
+                continue
+            label = c.get('title') or (c.get('body') or '')[:40]
+            if not driver.execute_script(OPEN_CARD_JS, c['key']):
+                failed += 1
+                print(f"  -> Could not open card '{label}'")
+                continue
+            note = driver.execute_async_script(EXPORT_NOTE_JS, color_keys) or {'error': 'no result'}
+            close_note(driver)
+            if note.get('error'):
+                failed += 1
+                print(f"  -> Could not export card '{label}': {note['error']}")
+                snap_failure(driver, 'export_failed')
+                continue
+            record = takeout_record(note, archived=(view == 'archive'))
+            record_hash = hashlib.sha1(json.dumps(record, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+            conn.execute("INSERT OR IGNORE INTO export_records VALUES (?, ?, 0)", (view, record_hash))
+            conn.execute("UPDATE export_records SET seen = seen + 1 WHERE view = ? AND record_hash = ?", (view, record_hash))
+            ordinal = conn.execute("SELECT seen FROM export_records WHERE view = ? AND record_hash = ?", (view, record_hash)).fetchone()[0]
+            suffix = f"_{ordinal}" if ordinal > 1 else ''
+            record_key = record_hash + suffix
+            name = sanitize_filename(record['title'] or (note.get('text') or '')[:40] or 'untitled')
+            filename = f"{name}_{record_hash[:10]}{suffix}.json"
+            path = os.path.join(export_dir, filename)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False, indent=2)
+            os.replace(path + '.tmp', path)
+            conn.execute("INSERT OR REPLACE INTO exported_notes VALUES (?, ?, ?, ?, ?)",
+                         (view, record_key, content_key, filename, int(time.time())))
+            conn.commit()
+            written += 1
+            new_here += 1
+            print(f"Exported: {filename}")
+        stalled = stalled + 1 if res.get('atEnd') and not new_here else 0
+        driver.execute_script("(document.scrollingElement || document.documentElement).scrollBy(0, Math.round(window.innerHeight * 0.8));")
+        time.sleep(0.25)
+    if failed:
+        print(f"{failed} card(s) in {view} could not be exported; re-run --export to retry them.")
+    return written
+
+def export_account(driver, export_dir: str) -> int:
+    """Stream every note of the account (main grid and archive) to Takeout-style JSON files in export_dir.
+
+    Each note is written as soon as it has been read, and progress lives in SQLite, so memory use does
+    not grow with the account and a re-run continues where an interrupted one stopped.
+    """
+    ensure_dir(export_dir)
+    conn = open_export_manifest(export_dir)
+    try:
+        written = sum(export_view(driver, conn, export_dir, view) for view in ('home', 'archive'))
+    finally:
+        conn.close()
+    driver.execute_script("window.location.hash = '#home';")
+    return written
+
+# --- Run metrics ---
+
+# Upper bounds (seconds) of the per-step latency histogram buckets
+STEP_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_WINDOW_SECONDS = 600  # notes/min and ETA are computed over this sliding window
+MEMORY_SAMPLE_EVERY = 10  # notes between browser memory samples (one script call each)
+
+class RunMetrics:
+    """Counters, gauges and step latency histograms for the current run, safe to read from another thread."""
+
+    def __init__(self, total: int):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.total = total
+        self.counts = {'created': 0, 'failed': 0, 'skipped': 0, 'recovered': 0}
+        self.gauges: Dict[str, float] = {}
+        self.current = ''
+        self._finished: deque = deque()
+        self._hist: Dict[str, List[float]] = {}  # step -> bucket counts (+Inf last), then sum, count
+
+    def count(self, outcome: str) -> None:
+        now = time.time()
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            self._finished.append(now)
+            while self._finished and self._finished[0] < now - RATE_WINDOW_SECONDS:
+                self._finished.popleft()
+
+    def observe(self, step: str, seconds: float) -> None:
+        with self._lock:
+            h = self._hist.setdefault(step, [0.0] * (len(STEP_BUCKETS) + 3))
+            for i, bound in enumerate(STEP_BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+            h[len(STEP_BUCKETS)] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            done = sum(self.counts.values())
+            window = min(RATE_WINDOW_SECONDS, max(now - self.started, 1e-9))
+            rate = len([t for t in self._finished if t >= now - window]) / window * 60
+            remaining = max(self.total - done, 0)
+            return {
+                'uptime_seconds': round(now - self.started, 1),
+                'total': self.total,
+                'processed': done,
+                **self.counts,
+                'rate_per_minute': round(rate, 2),
+                'eta_seconds': round(remaining / rate * 60) if rate > 0 else None,
+                'current': self.current,
+                **self.gauges,
+                'steps': {step: {'count': int(h[-1]), 'avg_seconds': round(h[-2] / h[-1], 3) if h[-1] else 0}
+                          for step, h in self._hist.items()},
+            }
+
+    def prometheus(self) -> str:
+        st = self.status()
+        lines = [
+            '# HELP keep_import_notes_total Notes processed this run by outcome.',
+            '# TYPE keep_import_notes_total counter',
+        ]
+        for outcome in self.counts:
+            lines.append(f'keep_import_notes_total{{outcome="{outcome}"}} {st[outcome]}')
+        simple = [
+            ('keep_import_notes_planned', 'Notes scheduled for this run.', st['total']),
+            ('keep_import_rate_per_minute', f'Notes processed per minute over the last {RATE_WINDOW_SECONDS}s.', st['rate_per_minute']),
+            ('keep_import_eta_seconds', 'Estimated seconds until all scheduled notes are processed.', st['eta_seconds'] if st['eta_seconds'] is not None else 'NaN'),
+            ('keep_import_uptime_seconds', 'Seconds since the run started.', st['uptime_seconds']),
+        ]
+        with self._lock:
+            simple += [(f'keep_import_{name}', GAUGE_HELP.get(name, name), value) for name, value in self.gauges.items()]
+            hist = {step: list(h) for step, h in self._hist.items()}
+        for name, help_text, value in simple:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        lines += ['# HELP keep_import_step_seconds Latency of individual note creation steps.',
+                  '# TYPE keep_import_step_seconds histogram']
+        for step, h in hist.items():
+            for i, bound in enumerate(STEP_BUCKETS):
+                lines.append(f'keep_import_step_seconds_bucket{{step="{step}",le="{bound}"}} {int(h[i])}')
+            lines.append(f'keep_import_step_seconds_bucket{{step="{step}",le="+Inf"}} {int(h[len(STEP_BUCKETS)])}')
+            lines.append(f'keep_import_step_seconds_sum{{step="{step}"}} {h[-2]:.6f}')
+            lines.append(f'keep_import_step_seconds_count{{step="{step}"}} {int(h[-1])}')
+        return '\n'.join(lines) + '\n'
+
+GAUGE_HELP = {
+    'browser_js_heap_bytes': 'JS heap in use by the Keep tab (performance.memory).',
+    'retry_queue_depth': 'Notes started but not committed; they are verified and retried on the next run.',
+}
+
+METRICS: Optional[RunMetrics] = None
+
+def observe_step(step: str, started: float) -> float:
+    """Record a step that began at `started`; returns now so consecutive steps can chain."""
+    now = time.time()
+    if METRICS is not None:
+        METRICS.observe(step, now - started)
+    return now
+
+def count_note(outcome: str, inflight: Optional[Dict[str, Any]] = None) -> None:
+    """Count a finished note (created/failed/skipped/recovered); refreshes the retry queue gauge if given."""
+    if METRICS is None:
+        return
+    METRICS.count(outcome)
+    if inflight is not None:
+        METRICS.set_gauge('retry_queue_depth', len(inflight))
+
+def start_metrics_server(metrics: RunMetrics, port: int, host: str = '127.0.0.1'):
+    """Serve /metrics (Prometheus text format) and /status (JSON) from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path == '/metrics':
+                body = metrics.prometheus().encode('utf-8')
+                ctype = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path in ('/', '/status'):
+                body = json.dumps(metrics.status(), ensure_ascii=False, indent=2).encode('utf-8')
+                ctype = 'application/json; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            debug_log(f"metrics: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+def sample_browser_memory(driver) -> None:
+    if METRICS is None or driver is None:
+        return
+    try:
+        used = driver.execute_script("return performance.memory ? performance.memory.usedJSHeapSize : null;")
+        if used is not None:
+            METRICS.set_gauge('browser_js_heap_bytes', int(used))
     except Exception:
         pass
-    debug_log(f"Could not verify note presence for any of: {queries!r}")
-    return False
-
-# --- Main Script ---
-driver = None  # Initialize driver to None
-manifest = load_manifest()
-created_ids_in_run = set()
-try:
-    # Parse CLI args
-    parser = argparse.ArgumentParser(description='Google Keep UI Migration')
-    parser.add_argument('--debug', action='store_true', help='Enable debug screenshots and verbose logs')
-    parser.add_argument('--limit', type=int, default=None, help='Limit number of notes to import this run')
-    args = parser.parse_args()
-    DEBUG = args.debug
-    LIMIT = args.limit
-    if DEBUG:
-        ensure_dir(DEBUG_DIR)
-        print(f"Debug mode ON. Artifacts in: {DEBUG_DIR}")
 
-    # 1. Create the driver instance
-    print("Initializing browser...")
+# --- Long notes ---
+
+def note_size(note: Dict[str, Any]) -> int:
+    """Characters to type for a parsed note (title, body and checklist items)."""
+    return len(note['title']) + len(note['content']) + sum(len(it.get('text', '') or '') for it in note['items'])
+
+def size_class(size: int) -> str:
+    """'small' (fast entry path), 'large' (chunked, checkpointed entry) or 'oversize' (past Keep's limit)."""
+    if size > KEEP_MAX_NOTE_CHARS:
+        return 'oversize'
+    if size > LARGE_NOTE_CHARS:
+        return 'large'
+    return 'small'
+
+def split_text(text: str, limit: int) -> List[str]:
+    """Cut text into pieces of at most `limit` characters, at paragraph, then line, then word boundaries."""
+    pieces: List[str] = []
+    rest = text
+    while len(rest) > limit:
+        cut = -1
+        for sep in ('\n\n', '\n', ' '):
+            cut = rest.rfind(sep, 0, limit)
+            if cut >= limit // 2:
+                break
+        if cut < limit // 2:
+            cut = limit
+        pieces.append(rest[:cut].rstrip())
+        rest = rest[cut:].lstrip()
+    pieces.append(rest)
+    return pieces
+
+def split_items(items: List[Dict[str, Any]], limit: int) -> List[List[Dict[str, Any]]]:
+    """Group checklist items in order so each group's text stays within `limit` characters."""
+    groups: List[List[Dict[str, Any]]] = [[]]
+    used = 0
+    for it in items:
+        n = len(it.get('text', '') or '')
+        if groups[-1] and used + n > limit:
+            groups.append([])
+            used = 0
+        groups[-1].append(it)
+        used += n
+    return groups
+
+def part_note_id(note_id: str, index: int, total: int) -> str:
+    """Manifest id of part `index` of `total` of a split note (same shape as compute_note_id)."""
+    return hashlib.sha1(f"{note_id}:part{index}/{total}".encode('utf-8')).hexdigest()
+
+def note_units(note_id: str, note: Dict[str, Any], split: bool = False) -> List[Dict[str, Any]]:
+    """The Keep notes to create for one source note: the note itself, or its parts when split=True and it is oversize.
+
+    Parts are titled "Title (part i/n)" and share the source note's colour, labels, pin and archive state.
+    """
+    size = note_size(note)
+    if not split or size <= KEEP_MAX_NOTE_CHARS:
+        return [{'id': note_id, 'title': note['title'], 'content': note['content'], 'items': note['items'], 'size': size}]
+    budget = KEEP_MAX_NOTE_CHARS - len(note['title']) - len(' (part 999/999)')
+    if note['items']:
+        pieces = [('', group) for group in split_items(note['items'], budget)]
+    else:
+        pieces = [(text, []) for text in split_text(note['content'], budget)]
+    units = []
+    for i, (content, items) in enumerate(pieces, 1):
+        title = f"{note['title']} (part {i}/{len(pieces)})" if note['title'] else f"Part {i}/{len(pieces)}"
+        unit = {'id': part_note_id(note_id, i, len(pieces)), 'title': title, 'content': content, 'items': items}
+        unit['size'] = note_size(unit)
+        # Parts share the title's opening, so they are told apart by its end ("... (part i/n)") and their own body
+        unit['check'] = [q for q in (title[-60:], content.strip()[:60]) if q]
+        units.append(unit)
+    return units
+
+def recovery_search(unit: Dict[str, Any]) -> Optional[str]:
+    """Search term that only matches a large note whose body was saved to the end (None for small notes).
+
+    Typing that stopped part way leaves a note whose title and opening match, and that note must be
+    re-imported, not recovered. Its last words (from a word boundary) are found only in a complete copy.
+    """
+    content = unit['content'].strip()
+    if size_class(unit['size']) == 'small' or not content:
+        return None
+    tail = content[-60:]
+    if len(content) > 60 and not content[-61].isspace() and ' ' in tail:
+        tail = tail.split(' ', 1)[1]  # drop the cut-off first word
+    return ' '.join(tail.split())
+
+def inflight_note_present(driver, unit: Dict[str, Any], record: Dict[str, Any]) -> bool:
+    """Whether an interrupted note made it into Keep in full (record: its in-flight entry, may be empty)."""
+    confirm = unit.get('check') or _opening_snippets(unit['title'], unit['content'])
+    search = record.get('search') or recovery_search(unit)
+    if search:
+        return verify_note_by_search(driver, search, confirm)
+    return verify_note_present(driver, unit['title'], unit['content'], timeout=1, queries=confirm)
+
+# --- Scheduling ---
+
+# --priority keys, applied in order (earlier keys win); ties keep the directory walk order
+PRIORITY_KEYS = {
+    'pinned': lambda e: 0 if e.pinned else 1,
+    'recent': lambda e: -e.edited_usec,
+    'small': lambda e: e.size,
+    'archived-last': lambda e: 1 if e.archived else 0,
+}
+DEFAULT_PRIORITY = 'pinned,recent,small'
+
+def parse_duration(value: str) -> float:
+    """'90', '90s', '45m' or '2h' -> seconds (argparse type for --time-budget)."""
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*', value or '')
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r} (use e.g. 600, 45m or 2h)")
+    return float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[m.group(2)]
+
+def parse_priority(value: str) -> List[str]:
+    keys = [k.strip() for k in (value or '').split(',') if k.strip()]
+    unknown = [k for k in keys if k not in PRIORITY_KEYS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown priority key(s): {', '.join(unknown)} (choose from {', '.join(PRIORITY_KEYS)})")
+    return keys
+
+class NoteRecord:
+    """What scheduling and sharding need to know about one source file.
+
+    Slotted, with the folder interned and the id kept as a 20-byte digest, so an index of a few
+    hundred thousand notes stays small.
+    """
+    __slots__ = ('folder', 'name', 'digest', 'pinned', 'archived', 'edited_usec', 'size')
+
+    def __init__(self, path: str, note_id: str, pinned: bool, archived: bool, edited_usec: int, size: int):
+        folder, self.name = os.path.split(path)
+        self.folder = sys.intern(folder)
+        self.digest = bytes.fromhex(note_id)
+        self.pinned = pinned
+        self.archived = archived
+        self.edited_usec = edited_usec
+        self.size = size
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.folder, self.name)
+
+    @property
+    def note_id(self) -> str:
+        return self.digest.hex()
+
+    @property
+    def size_class(self) -> str:
+        return size_class(self.size)
+
+def index_notes(json_files: Iterable[str]) -> List[NoteRecord]:
+    """One pass over the corpus collecting what scheduling and sharding need; unreadable files are dropped."""
+    entries = []
+    for file_path in json_files:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Skipping unreadable file: {file_path} ({e})")
+            continue
+        size = len(data.get('title', '') or '') + len(data.get('textContent', '') or '')
+        size += sum(len(it.get('text', '') or '') for it in (data.get('listContent', []) or []))
+        try:
+            edited = int(data.get('userEditedTimestampUsec') or 0)
+        except (TypeError, ValueError):
+            edited = 0
+        entries.append(NoteRecord(
+            file_path,
+            compute_note_id(data),
+            bool(data.get('isPinned', False)),
+            bool(data.get('isArchived', False)),
+            edited,
+            size,
+        ))
+    return entries
+
+def schedule_notes(entries: List[NoteRecord], priority: List[str]) -> List[NoteRecord]:
+    """Order work so a time-limited run spends its budget on the most valuable notes first."""
+    if not priority:
+        return list(entries)
+    keys = [PRIORITY_KEYS[k] for k in priority]
+    return sorted(entries, key=lambda e: tuple(k(e) for k in keys))
+
+# --- Multi-host sharding ---
+
+LEASE_DB_NAME = 'leases.db'
+# A claimed note is reassigned once its lease is this old (the claiming host is assumed dead)
+LEASE_TTL_SECONDS = 600
+# How often a note leased by another host is looked at again (sooner if its lease expires first)
+LEASE_RECHECK_SECONDS = 30
+# --dry-run: simulated per-note work so several local processes interleave like real hosts
+DRY_RUN_NOTE_SECONDS = 0.2
+
+def lease_owner_id() -> str:
+    """Host name plus working directory: the same across restarts, and one per Chrome profile and in-flight file."""
+    return f"{socket.gethostname()}:{BASE_DIR}"
+
+def note_shard(note_id: str, shards: int) -> int:
+    """Contiguous hash range of note_id (hex SHA-1) that a note belongs to, in [0, shards)."""
+    return (int(note_id[:8], 16) * shards) >> 32
+
+def order_for_shard(entries: List[NoteRecord], shard: int, shards: int) -> List[NoteRecord]:
+    """Own hash range first, then everyone else's, so idle hosts pick up work a dead host never started.
+
+    The split is stable, so the scheduled priority order holds within each part.
+    """
+    own = [e for e in entries if note_shard(e.note_id, shards) == shard]
+    rest = [e for e in entries if note_shard(e.note_id, shards) != shard]
+    return own + rest
+
+def open_lease_db(shared_dir: str) -> sqlite3.Connection:
+    """Lease table shared by all hosts; SQLite's file lock serializes claims."""
+    ensure_dir(shared_dir)
+    conn = sqlite3.connect(os.path.join(shared_dir, LEASE_DB_NAME), timeout=60, isolation_level=None)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS leases ("
+        " note_id TEXT PRIMARY KEY, owner TEXT, state TEXT, expires_at REAL, file TEXT, title TEXT, ts INTEGER)"
+    )
+    return conn
+
+def claim_lease(conn: sqlite3.Connection, note_id: str, owner: str, ttl: int = LEASE_TTL_SECONDS) -> Optional[str]:
+    """Try to take note_id for this host.
+
+    Returns 'new' for an untouched note, 'takeover' when an expired lease of another host was taken over
+    (that host may have saved the note before dying, so it needs verifying), or None if the note is
+    done or currently leased by someone else.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT owner, state, expires_at FROM leases WHERE note_id = ?", (note_id,)).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO leases (note_id, owner, state, expires_at) VALUES (?, ?, 'leased', ?)",
+                (note_id, owner, now + ttl),
+            )
+            claim = 'new'
+        elif row[1] == 'done' or (row[0] != owner and row[2] > now):
+            claim = None
+        else:
+            conn.execute("UPDATE leases SET owner = ?, expires_at = ? WHERE note_id = ?", (owner, now + ttl, note_id))
+            claim = 'new' if row[0] == owner else 'takeover'
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if claim == 'takeover':
+        debug_log(f"Took over expired lease of {row[0]} for {note_id}")
+    return claim
+
+def lease_expiry(conn: sqlite3.Connection, note_id: str, owner: str) -> Optional[float]:
+    """When another host's lease on note_id runs out (possibly already past); None if it is done or not theirs."""
+    row = conn.execute("SELECT owner, state, expires_at FROM leases WHERE note_id = ?", (note_id,)).fetchone()
+    if row is None or row[1] == 'done' or row[0] == owner:
+        return None
+    return row[2]
+
+def release_lease(conn: sqlite3.Connection, note_id: str, owner: str) -> None:
+    """Give up this host's lease on a note that failed, so any host can claim it now instead of after the TTL.
+
+    The owner is kept: another host taking it over verifies the note first, as it may have been saved.
+    """
+    conn.execute(
+        "UPDATE leases SET expires_at = 0 WHERE note_id = ? AND owner = ? AND state = 'leased'", (note_id, owner)
+    )
+
+def commit_lease(conn: sqlite3.Connection, note_id: str, owner: str, filename: str, title: str) -> None:
+    """Mark note_id as imported for every host (also used for notes found in the local manifest)."""
+    conn.execute(
+        "INSERT INTO leases (note_id, owner, state, expires_at, file, title, ts) VALUES (?, ?, 'done', 0, ?, ?, ?)"
+        " ON CONFLICT(note_id) DO UPDATE SET owner = excluded.owner, state = 'done', expires_at = 0,"
+        " file = excluded.file, title = excluded.title, ts = excluded.ts",
+        (note_id, owner, filename, title, int(time.time())),
+    )
+
+def setup_driver():
+    """create_driver() plus the per-session setup (CDP check, agent script timeout); used for every new driver."""
+    global USE_CDP
     driver = create_driver()
-    
-    # 2. Add a pause to let the browser initialize fully
-    time.sleep(3) 
+    if USE_CDP and not hasattr(driver, 'execute_cdp_cmd'):
+        print("This driver does not expose execute_cdp_cmd; continuing with WebDriver only.")
+        USE_CDP = False
+    driver.set_script_timeout(AGENT_SCRIPT_TIMEOUT)
+    return driver
+
+def start_browser():
+    """Launch Chrome with the persistent profile and open Keep, logged in and ready for the composer."""
+    print("Initializing browser...")
+    driver = setup_driver()
+    # Waits for manual login only when the profile has no valid session
+    return open_keep(driver)
 
-    # 3. Open Google Keep and wait for manual login (first run) or until main page loads (subsequent runs)
+def open_keep(driver):
+    """Open Keep and wait until the composer is usable; returns the (possibly recreated) driver."""
     print("Opening Google Keep...")
-    driver.get("https://keep.google.com/#home")
+    driver.get(KEEP_HOME_URL)
+    if keep_session_ready(driver):
+        debug_log('Existing profile session is valid; skipping login wait.')
+        return driver
 
     print("="*40)
     print("ACTION REQUIRED:")
@@ -798,13 +2512,13 @@ try:
     try:
         # Ensure we actually landed on the Keep app, then check editor presence
         try:
-            wait_for_keep_url(driver, timeout=300)
+            wait_for_keep_url(driver, timeout=LOGIN_TIMEOUT_SECONDS)
         except Exception:
             pass
         wait_for_keep_ready(driver)
-    except (WebDriverException, TimeoutException, Exception) as e:
+    except Exception as e:
         print(f"Could not detect Keep composer: {e}")
-        snap(driver, 'keep_ready_exception', html=True)
+        snap_failure(driver, 'keep_ready_exception')
         # Attempt one restart if window was closed
         try:
             if not getattr(driver, 'window_handles', []):
@@ -813,208 +2527,419 @@ try:
                     driver.quit()
                 except Exception:
                     pass
-                driver = create_driver()
-                time.sleep(2)
-                driver.get("https://keep.google.com")
+                driver = setup_driver()
+                driver.get(KEEP_HOME_URL)
                 wait_for_keep_ready(driver)
             else:
                 raise
         except Exception as e2:
             print(f"Retry failed: {e2}")
             sys.exit(1)
-    print("Login detected. Starting note creation in 5 seconds...")
-    time.sleep(5)
+    print("Login detected.")
+    return driver
+
+def create_note(driver, unit: Dict[str, Any], note: Dict[str, Any]) -> None:
+    """Create the Keep note for `unit` (a whole note or one part of a split note) and confirm it is visible.
+
+    Small notes use the in-page agent when --agent is on; large ones always take the checkpointed Selenium path.
+    Raises on failure.
+    """
+    title, content, items = unit['title'], unit['content'], unit['items']
+    color_key, is_archived = note['color_key'], note['is_archived']
+    large = size_class(unit['size']) != 'small'
+    started = time.time()
+    created = False
+    if USE_AGENT and not large:
+        result = create_note_with_agent(driver, {
+            'title': title,
+            'text': content,
+            'items': [it.get('text', '') for it in items if it.get('text')],
+            'color': COLOR_MAP.get(color_key.upper()),
+            'pinned': note['is_pinned'],
+            'archived': is_archived,
+            'labels': note['labels'],
+        })
+        step = result.get('step')
+        if result.get('ok'):
+            created = True
+            observe_step('agent_create', started)
+        elif step in AGENT_FALLBACK_STEPS:
+            debug_log(f"Agent could not start the note ({result.get('error')}); using Selenium steps.")
+        elif step == 'items' and result.get('discarded'):
+            debug_log(f"Agent checklist did not read back ({result.get('error')}); note discarded, using Selenium steps.")
+        elif step == 'color' and result.get('archived'):
+            # The note was created and archived (it closed); only its colour is unconfirmed
+            print(f"  -> Colour of archived note '{title}' could not be confirmed; check it with --reconcile.")
+            created = True
+            observe_step('agent_create', started)
+        elif step in AGENT_FINISH_STEPS and not result.get('archived'):
+            debug_log(f"Agent could not confirm {step} ({result.get('error')}); finishing the note with Selenium steps.")
+            labels = (result.get('missing') or note['labels']) if step == 'labels' else []
+            finish_note_ui(driver, labels, color_key, note['is_pinned'], is_archived)
+            created = True
+        else:
+            raise RuntimeError(f"In-page agent failed at step '{result.get('step')}': {result.get('error')}")
+    if not created:
+        create_note_ui(driver, title, content, items, color_key, note['is_pinned'], is_archived, note['labels'], large=large)
+
+    short_sleep(0.5, 1.0)
+
+    # Verify the note card appears before recording manifest (skip for archived)
+    if not is_archived:
+        verify_started = time.time()
+        verified = verify_note_present(driver, title, content, queries=unit.get('check'))
+        observe_step('verify', verify_started)
+        if not verified:
+            raise RuntimeError('Note not visible after save; verification failed')
+
+def plan_import(json_files: List[str], manifest: Manifest, inflight: Dict[str, Any], split: bool = False,
+                unreadable: int = 0) -> None:
+    """Offline dry run: report what an import would do, without starting a browser.
+
+    `unreadable` counts files already dropped (and reported) by index_notes before json_files was built.
+    """
+    counts = {'new': 0, 'imported': 0, 'inflight': 0, 'empty': 0, 'unreadable': unreadable, 'large': 0, 'oversize': 0}
+    for file_path in json_files:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            counts['unreadable'] += 1
+            print(f"Unreadable: {file_path} ({e})")
+            continue
+        note = parse_note(data)
+        note_id = compute_note_id(data)
+        if note_id in manifest:
+            counts['imported'] += 1
+        elif note_id in inflight:
+            counts['inflight'] += 1
+            print(f"Would verify in-flight note: '{note['title']}' ({os.path.basename(file_path)})")
+        elif not note['title'] and not note['content'] and not note['items']:
+            counts['empty'] += 1
+        else:
+            counts['new'] += 1
+            size = note_size(note)
+            kind = size_class(size)
+            if kind != 'small':
+                counts[kind] += 1
+            parts = len(note_units(note_id, note, split))
+            if parts > 1:
+                print(f"Would create note in {parts} parts: '{note['title']}' ({size} characters, {os.path.basename(file_path)})")
+            elif kind == 'oversize':
+                print(f"Would create note over Keep's size limit: '{note['title']}' ({size} characters, {os.path.basename(file_path)}; see --split-long)")
+            else:
+                print(f"Would create note: '{note['title']}' ({os.path.basename(file_path)})")
+    print(f"Plan: {counts['new']} to create, {counts['inflight']} in-flight to verify, "
+          f"{counts['imported']} already imported, {counts['empty']} empty, {counts['unreadable']} unreadable.")
+    if counts['large'] or counts['oversize']:
+        print(f"Of the notes to create, {counts['large']} are typed in checkpointed chunks and "
+              f"{counts['oversize']} exceed Keep's limit of about {KEEP_MAX_NOTE_CHARS} characters"
+              f"{' and will be split' if split else ''}.")
 
-    # Find and process all .json files (recursive)
-    json_files: List[str] = []
-    for root, _, files in os.walk(NOTES_DIR):
-        for f in files:
-            if f.endswith('.json'):
-                full_path = os.path.join(root, f)
-                # Skip our manifest file if it's inside the scan directory
-                if os.path.abspath(full_path) == os.path.abspath(MANIFEST_PATH):
-                    continue
-                json_files.append(full_path)
+# --- Main Script ---
+def main():
+    global DEBUG, LIMIT, USE_CDP, USE_AGENT, DEBUG_CAPTURE, METRICS
+    run_started = time.time()
+    # Parse CLI args
+    parser = argparse.ArgumentParser(description='Google Keep UI Migration')
+    parser.add_argument('--debug', action='store_true', help='Enable debug screenshots and verbose logs')
+    parser.add_argument('--debug-ring', type=int, default=DEBUG_RING_SIZE, help='Debug snapshots kept in memory and saved when a note fails')
+    parser.add_argument('--limit', type=int, default=None, help='Limit number of notes to import this run (after prioritizing)')
+    parser.add_argument('--priority', type=parse_priority, default=parse_priority(DEFAULT_PRIORITY),
+                        help=f"Import order as comma-separated keys from: {', '.join(PRIORITY_KEYS)} (default: {DEFAULT_PRIORITY}; '' keeps directory order)")
+    parser.add_argument('--time-budget', type=parse_duration, default=None, help='Stop cleanly before this much wall time has passed (e.g. 3600, 45m, 2h)')
+    parser.add_argument('--cdp', action='store_true', help='Use Chrome DevTools Protocol for text entry and DOM queries (WebDriver fallback)')
+    parser.add_argument('--agent', action='store_true', help='Create each note with one call into an injected in-page script (Selenium fallback)')
+    parser.add_argument('--split-long', action='store_true', help=f"Import notes over Keep's size limit (~{KEEP_MAX_NOTE_CHARS} characters) as linked 'Title (part i/n)' notes")
+    parser.add_argument('--notes-dir', default=NOTES_DIR, help='Directory with exported Keep JSON files (default: NOTES_DIR)')
+    parser.add_argument('--plan', action='store_true', help='Show what would be imported and exit (offline, no browser)')
+    parser.add_argument('--shared-dir', default=None, help='Coordination directory shared by all hosts of a sharded import (lease table)')
+    parser.add_argument('--shard', default=None, help='This host\'s hash range as I/N (e.g. 0/3); requires --shared-dir')
+    parser.add_argument('--dry-run', action='store_true', help='Run the import loop without a browser; nothing is typed and the local manifest is not written (leases are)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve live progress on http://127.0.0.1:PORT/metrics (Prometheus) and /status (JSON)')
+    parser.add_argument('--export', metavar='DIR', default=None, help='Export every note of the account to Takeout-style JSON files in DIR (resumable) and exit')
+    parser.add_argument('--reconcile', action='store_true', help='Scrape the whole account and report notes missing or different from the source')
+    args = parser.parse_args()
+    DEBUG = args.debug
+    LIMIT = args.limit
+    USE_CDP = args.cdp
+    USE_AGENT = args.agent
+    notes_dir = args.notes_dir
+    shard, shards = 0, 1
+    if args.shard:
+        try:
+            shard, shards = (int(x) for x in args.shard.split('/'))
+            if not 0 <= shard < shards:
+                raise ValueError
+        except ValueError:
+            parser.error('--shard must look like I/N with 0 <= I < N')
+        if not args.shared_dir:
+            parser.error('--shard requires --shared-dir')
+    if args.reconcile and args.dry_run:
+        parser.error('--reconcile reads the account in the browser and cannot be combined with --dry-run')
 
-    print(f"Found {len(json_files)} JSON file(s) in: {NOTES_DIR}")
+    if DEBUG:
+        ensure_dir(DEBUG_DIR)
+        DEBUG_CAPTURE = DebugCapture(args.debug_ring)
+        print(f"Debug mode ON. Last {args.debug_ring} step(s) are saved to {DEBUG_DIR} when a note fails.")
+
+    if args.export:
+        driver = None
+        try:
+            driver = start_browser()
+            written = export_account(driver, args.export)
+            print(f"\n✅ Export complete: {written} note(s) written to {args.export}")
+        finally:
+            if driver:
+                driver.quit()
+            if DEBUG_CAPTURE is not None:
+                DEBUG_CAPTURE.close()
+        return
+
+    manifest = open_manifest()
+    inflight = load_inflight()
+    created_ids_in_run = DigestSet()
+
+    # Find and process all .json files (recursive)
+    json_files = scan_json_files(notes_dir)
+    print(f"Found {len(json_files)} JSON file(s) in: {notes_dir}")
     if not json_files:
         print("No .json files found. Please verify NOTES_DIR and that your Takeout JSON files are present.")
         raise SystemExit(1)
 
+    if args.reconcile:
+        # Always against the whole corpus: --limit, --priority and --shard only shape an import
+        driver = None
+        try:
+            driver = start_browser()
+            print("Reconciling account contents against the source notes...")
+            report = reconcile(driver, json_files)
+            print(f"Scraped {report['keep_cards']} card(s) into {RECONCILE_DB_PATH}.")
+            print(f"{report['source_notes']} source note(s): {len(report['missing'])} missing, "
+                  f"{len(report['mismatched'])} mismatched, {len(report['duplicates'])} duplicated; "
+                  f"{report['unmatched_cards']} card(s) not from the source. Report: {RECONCILE_REPORT_PATH}")
+        finally:
+            if driver:
+                driver.quit()
+            if DEBUG_CAPTURE is not None:
+                DEBUG_CAPTURE.close()
+        return
+
+    entries = schedule_notes(index_notes(json_files), args.priority)
+    unreadable = len(json_files) - len(entries)  # index_notes drops (and reports) files it can't parse
+    del json_files  # the records hold the paths from here on
+    if args.priority:
+        print(f"Import order: {', '.join(args.priority)}.")
+    large_notes = sum(1 for e in entries if e.size_class == 'large')
+    oversize_notes = sum(1 for e in entries if e.size_class == 'oversize')
+    if large_notes or oversize_notes:
+        print(f"{large_notes} large note(s) will be typed in checkpointed chunks; {oversize_notes} exceed Keep's size limit"
+              f"{' and will be split into parts' if args.split_long else ' (use --split-long to split them)'}.")
+
+    lease_db = None
+    lease_owner = lease_owner_id()
+    if args.shared_dir and not args.plan:
+        lease_db = open_lease_db(args.shared_dir)
+        entries = order_for_shard(entries, shard, shards)
+        print(f"Sharded import as {lease_owner}: range {shard}/{shards} first, then unclaimed notes of other hosts.")
+
     if LIMIT is not None and LIMIT > 0:
-        json_files = json_files[:LIMIT]
+        entries = entries[:LIMIT]
         print(f"Limiting to first {LIMIT} file(s) for this run.")
 
-    for file_path in json_files:
-        filename = os.path.basename(file_path)
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        title = data.get('title', '') or ''
-        content = data.get('textContent', '') or ''
-        items = data.get('listContent', []) or []
-        color_key = data.get('color', 'DEFAULT') or 'DEFAULT'
-        is_pinned = bool(data.get('isPinned', False))
-        is_archived = bool(data.get('isArchived', False))
-        labels = []
-        raw_labels = data.get('labels', []) or []
-        for lab in raw_labels:
-            if isinstance(lab, dict):
-                name = lab.get('name') or lab.get('label')
-                if name:
-                    labels.append(name)
-            elif isinstance(lab, str):
-                labels.append(lab)
-        if IMPORT_LABEL:
-            labels.append(IMPORT_LABEL)
+    if args.plan:
+        plan_import([e.path for e in entries], manifest, inflight, args.split_long, unreadable)
+        return
 
-        note_id = compute_note_id(data)
-        if note_id in manifest or note_id in created_ids_in_run:
-            # Validate manifest entry by checking the note exists; if missing, self-heal and re-import
-            if verify_note_present(driver, title, content):
+    deadline = run_started + args.time_budget if args.time_budget else None
+
+    if args.metrics_port:
+        METRICS = RunMetrics(total=len(entries))
+        METRICS.set_gauge('retry_queue_depth', len(inflight))
+        start_metrics_server(METRICS, args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics (JSON status at /status).")
+
+    driver = None  # Initialize driver to None
+    try:
+        if not args.dry_run:
+            driver = start_browser()
+            print(f"Keep ready after {time.time() - run_started:.1f}s.")
+
+        first_note_reported = False
+        loop_started = time.time()
+        notes_created = 0
+
+        # Notes another host holds go to the back of the queue and come round again until
+        # that host finishes them or its lease expires (a crashed host's work is taken over)
+        work = deque((entry, 0.0) for entry in entries)
+        waiting_reported = False
+        stopped_for_budget = False
+        while work:
+            entry, not_before = work.popleft()
+            if not_before:
+                if not waiting_reported:
+                    waiting_reported = True
+                    print(f"Waiting on {len(work) + 1} note(s) leased by other hosts...")
+                if deadline is not None and not_before > deadline:
+                    stopped_for_budget = True
+                    print(f"Time budget reached; stopping with {len(work) + 1} file(s) left for the next run.")
+                    break
+                time.sleep(max(0.0, not_before - time.time()))
+            file_path = entry.path
+            filename = entry.name
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            note = parse_note(data)
+            title = note['title']
+            content = note['content']
+            items = note['items']
+            color_key = note['color_key']
+            is_pinned = note['is_pinned']
+            is_archived = note['is_archived']
+            labels = note['labels']
+
+            note_id = compute_note_id(data)
+            if note_id in manifest or note_id in created_ids_in_run:
+                # Committed entries are trusted as-is; only in-flight notes need a look at the account
+                clear_inflight(inflight, note_id)
+                if lease_db is not None:
+                    commit_lease(lease_db, note_id, lease_owner, filename, title)
                 print(f"Skipping already imported note: '{title}'")
+                count_note('skipped', inflight)
+                continue
+            if not title and not content and not items:
+                # Checked before claiming: an empty note is never created, so its lease would never be committed
+                count_note('skipped')
                 continue
-            else:
-                print(f"Manifest had '{title}' but it is not visible. Will re-import it.")
-                manifest.pop(note_id, None)
-                save_manifest(manifest)
-        
-        if not title and not content and not items:
-            continue
 
-        print(f"Creating note: '{title}'")
-        debug_log(f"Labels: {labels}; Pinned: {is_pinned}; Archived: {is_archived}; Color: {color_key}")
-        if DEBUG:
-            # Selector diagnostics
-            try:
-                elems = driver.find_elements(By.CSS_SELECTOR, 'div[role="button"][aria-label^="Take a note"]')
-                debug_log(f"Compact composer candidates: {len(elems)}")
-            except Exception:
-                pass
+            units = note_units(note_id, note, args.split_long)
+            if deadline is not None:
+                # Don't start a note that likely won't finish in time; everything done so far is committed.
+                # Checked before claiming, so stopping never leaves a lease behind.
+                expected = (time.time() - loop_started) / notes_created * len(units) if notes_created else 0
+                if time.time() + expected > deadline:
+                    stopped_for_budget = True
+                    print(f"Time budget reached; stopping with {len(work) + 1} file(s) left for the next run.")
+                    break
+
+            claim = None
+            if lease_db is not None:
+                claim = claim_lease(lease_db, note_id, lease_owner)
+                if claim is None:
+                    expires = lease_expiry(lease_db, note_id, lease_owner)
+                    if expires is None:
+                        debug_log(f"Note '{title}' is done by another host.")
+                        count_note('skipped')
+                    else:
+                        debug_log(f"Note '{title}' is leased by another host; will look again.")
+                        work.append((entry, min(expires, time.time() + LEASE_RECHECK_SECONDS)))
+                    continue
 
-        try:
-            # Decide note type: checklist if listContent present, else text note
-            if items:
-                if not start_new_list_note(driver):
-                    # fallback to text note
-                    if not open_compact_composer(driver):
-                        raise RuntimeError('Cannot open composer')
-            else:
-                if not open_compact_composer(driver):
-                    raise RuntimeError('Cannot open composer')
+            if len(units) > 1:
+                print(f"Splitting '{title}' ({note_size(note)} characters) into {len(units)} parts.")
+            elif size_class(units[0]['size']) == 'oversize':
+                print(f"Warning: '{title}' has {units[0]['size']} characters, over Keep's limit of about "
+                      f"{KEEP_MAX_NOTE_CHARS}; Keep may refuse to save it (see --split-long).")
+
+            if args.dry_run:
+                print(f"Dry run: would create note '{title}'" + (f" in {len(units)} parts" if len(units) > 1 else ''))
+                time.sleep(DRY_RUN_NOTE_SECONDS)
+                notes_created += len(units)
+                created_ids_in_run.add(note_id)
+                if lease_db is not None:
+                    commit_lease(lease_db, note_id, lease_owner, filename, title)
+                count_note('created')
+                continue
 
-            # Expand editor first to ensure title is present
-            editor = None
-            try:
-                editor = get_content_editor(driver)
-            except Exception:
-                pass
-            # Click editor to fully expand title region
-            try:
-                if editor is not None:
-                    editor.click()
-                    short_sleep(0.05, 0.12)
-            except Exception:
-                pass
-            # Click the editor to fully expand header/title region
-            try:
-                if editor is not None:
-                    editor.click()
-                    short_sleep(0.05, 0.12)
-            except Exception:
-                pass
+            debug_log(f"Labels: {labels}; Pinned: {is_pinned}; Archived: {is_archived}; Color: {color_key}")
+            if DEBUG:
+                # Selector diagnostics
+                try:
+                    elems = driver.find_elements(By.CSS_SELECTOR, 'div[role="button"][aria-label^="Take a note"]')
+                    debug_log(f"Compact composer candidates: {len(elems)}")
+                except Exception:
+                    pass
 
-            # Fill title (after editor presence to ensure expanded UI)
-            try:
-                if title:
-                    title_input = get_title_input(driver)
-                    _send_text_to_element(driver, title_input, title)
-            except Exception:
-                # As a fallback, focus body and SHIFT+TAB (try up to 3 times) to move to title, then type
-                if title and editor is not None:
+            split = len(units) > 1
+            done = True
+            created_any = False
+            for i, unit in enumerate(units, 1):
+                unit_id = unit['id']
+                # Parts carry their group so the manifest shows which source note they came from
+                part_fields = {'group': note_id, 'part': i} if split else {}
+                if split and unit_id in manifest:
+                    continue  # part committed by an earlier run
+                if unit_id in inflight or claim == 'takeover':
+                    # A previous run (here or on a dead host) started this note without committing it
+                    verify_started = time.time()
+                    if (driver is not None and not inflight.get(unit_id, {}).get('archived') and not is_archived
+                            and inflight_note_present(driver, unit, inflight.get(unit_id, {}))):
+                        print(f"Recovered in-flight note (already in Keep): '{unit['title']}'")
+                        observe_step('verify_inflight', verify_started)
+                        commit_note(manifest, inflight, unit_id, filename, unit['title'], **part_fields)
+                        continue
+                    observe_step('verify_inflight', verify_started)
+                    if driver is not None:
+                        print(f"In-flight note '{unit['title']}' is not visible. Will re-import it.")
+                        clear_inflight(inflight, unit_id)
+
+                print(f"Creating note: '{unit['title']}'")
+                note_started = time.time()
+                if METRICS is not None:
+                    METRICS.current = unit['title']
+                mark_inflight(inflight, unit_id, filename, unit['title'], is_archived, recovery_search(unit))
+                invalidate_search_cache()
+                try:
+                    create_note(driver, unit, note)
+                    commit_note(manifest, inflight, unit_id, filename, unit['title'], **part_fields)
+                    created_any = True
+                    notes_created += 1
+                    if notes_created % MEMORY_SAMPLE_EVERY == 1:
+                        sample_browser_memory(driver)
+                    print(f"  -> Created in {time.time() - note_started:.1f}s")
+                    if not first_note_reported:
+                        first_note_reported = True
+                        print(f"  -> Time to first note: {time.time() - run_started:.1f}s")
+
+                except Exception as e:
+                    # The in-flight record is kept on purpose: the note may have been saved before the error
+                    print(f"  -> Failed to create note '{unit['title']}'. Error: {e}")
                     try:
-                        from selenium.webdriver.common.keys import Keys
-                        editor.click()
-                        short_sleep(0.05, 0.12)
-                        success = False
-                        for _ in range(3):
-                            try:
-                                editor.send_keys(Keys.SHIFT, Keys.TAB)
-                                short_sleep(0.1, 0.2)
-                                active = driver.switch_to.active_element
-                                aria = (active.get_attribute('aria-label') or '').lower()
-                                if 'title' in aria:
-                                    _send_text_to_element(driver, active, title)
-                                    success = True
-                                    debug_log('Title entered via SHIFT+TAB fallback.')
-                                    break
-                            except Exception:
-                                continue
-                        if not success:
-                            debug_log('Title entry SHIFT+TAB fallback did not succeed.')
+                        snap_failure(driver, f"error_{sanitize_filename(unit['title'])}")
+                        driver.refresh()
                     except Exception:
-                        debug_log('Title entry fallback failed.')
-
-            # Fill body content or checklist items
-            try:
-                if editor is None:
-                    editor = get_content_editor(driver)
-                if items:
-                    # Add checklist items
-                    from selenium.webdriver.common.keys import Keys
-                    for it in items:
-                        text = it.get('text', '') or ''
-                        if not text:
-                            continue
-                        editor.click()
-                        editor.send_keys(text)
-                        editor.send_keys(Keys.ENTER)
-                        short_sleep(0.05, 0.15)
-                    # Checked state is difficult to set reliably via UI; best-effort omitted
-                else:
-                    if content:
-                        _send_text_to_element(driver, editor, content)
-            except Exception as body_err:
-                debug_log(f"Error entering body content: {body_err}")
-            # Apply pin, color, labels
-            set_pinned_state(driver, is_pinned)
-            set_color(driver, color_key)
-            add_labels(driver, labels)
-
-            # Archive if requested (this usually closes the note)
-            archived_closed = set_archive_state(driver, is_archived)
-            if not archived_closed:
-                close_note(driver)
-
-            short_sleep(0.5, 1.0)
-
-            # Verify the note card appears before recording manifest (skip for archived)
-            verified = True
-            if not is_archived:
-                verified = verify_note_present(driver, title, content)
-            if not verified:
-                raise RuntimeError('Note not visible after save; verification failed')
-
-            # Mark as imported
-            manifest[note_id] = {
-                'file': filename,
-                'title': title,
-                'ts': int(time.time()),
-            }
+                        pass
+                    time.sleep(5)
+                    # Stop this note here so the remaining parts are created in order on the next run
+                    done = False
+                    break
+
+            if not done:
+                if lease_db is not None:
+                    release_lease(lease_db, note_id, lease_owner)
+                count_note('failed', inflight)
+                continue
+            # Mark as imported; a split note's own entry lists its parts once all of them are in
+            if split:
+                commit_note(manifest, inflight, note_id, filename, title, parts=[u['id'] for u in units])
             created_ids_in_run.add(note_id)
-            save_manifest(manifest)
-
-        except Exception as e:
-            print(f"  -> Failed to create note '{title}'. Error: {e}")
-            try:
-                snap(driver, f"error_{sanitize_filename(title)}", html=True)
-                driver.refresh()
-            except Exception:
-                pass
-            time.sleep(5)
+            if lease_db is not None:
+                commit_lease(lease_db, note_id, lease_owner, filename, title)
+            count_note('created' if created_any else 'recovered', inflight)
 
-    print("\n✅ Migration process complete!")
-
-finally:
-    if driver:
-        driver.quit()
\ No newline at end of file
+        if stopped_for_budget:
+            print(f"\n⏸ Stopped at the time budget after {notes_created} note(s); run again to continue.")
+        else:
+            print("\n✅ Migration process complete!")
+
+    finally:
+        if driver:
+            driver.quit()
+        if lease_db is not None:
+            lease_db.close()
+        if DEBUG_CAPTURE is not None:
+            DEBUG_CAPTURE.close()
+
+if __name__ == '__main__':
+    main()